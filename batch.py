@@ -0,0 +1,330 @@
+"""
+File name: batch
+
+##############################
+
+Purpose:
+
+Run the AMS and IDF steps over many station time series,
+distributing the stations across a pool of worker processes.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from constructIDF import AMS, IDF
+import cache
+import fitcache
+from incremental import update_station
+import plotting
+from prefetch import Prefetcher
+import profiling
+from store import ResultStore
+import pandas as pd
+import numpy as np
+import functools
+import glob
+import os
+import sys
+import time
+import traceback
+
+
+def find_stations(source):
+    """
+    List the station time series files to process.
+
+    Parameters
+    ----------
+    Input:
+        source: str, either a single station file (.csv or .csv.gz), a directory (all .csv and .csv.gz
+                files inside are used), a manifest file with any other extension and one path per line
+                (relative paths are taken from the manifest location, lines starting with # are
+                ignored) or a glob pattern.
+    Output:
+        list of str, sorted paths of the station files.
+    """
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '*.csv')) +
+                      glob.glob(os.path.join(source, '*.csv.gz')))
+    elif os.path.isfile(source) and source.endswith(('.csv', '.csv.gz')):
+        return [source]
+    elif os.path.isfile(source):
+        root = os.path.dirname(os.path.abspath(source))
+        with open(source) as manifest:
+            lines = [line.strip() for line in manifest]
+        return [os.path.join(root, line) for line in lines
+                if line and not line.startswith('#')]
+    return sorted(glob.glob(source))
+
+
+def station_name(path):
+    """
+    Station identifier, the file name without its extension (and without .gz if compressed).
+    """
+    name = os.path.basename(path)
+    if name.endswith('.gz'):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+
+def load_station(path, cache_dir=None):
+    """
+    Read the records of a station file, from the time series cache if cache_dir is given.
+
+    Output:
+        minutes, values, column: see cache.parse_series.
+    """
+    if cache_dir is not None:
+        minutes, values, column = cache.load_series(path, cache_dir)
+        # Read the memory-mapped arrays now, not when the worker uses them.
+        return np.array(minutes), np.array(values), column
+    return cache.parse_series(path)
+
+
+def prefetch_station(path, cache_dir=None, profile=False):
+    """
+    Read the records of a station file in the prefetch thread, see load_station.
+
+    Output:
+        series: tuple, see load_station.
+        records: list of dict, profiling record of the read, labelled by station, empty if not profile.
+    """
+    if not profile:
+        return load_station(path, cache_dir), []
+    # A Profiler of the thread itself, the active one of profiling is not thread safe.
+    profiler = profiling.Profiler()
+    profiler.labels['station'] = station_name(path)
+    with profiler.stage('load', prefetched=True):
+        series = load_station(path, cache_dir)
+    return series, profiler.records
+
+
+def process_station(path, savepath, durations, ftype, ci=False, number_bootstrap=100,
+                    alpha=0.9, method='mle', seed=None, figformat=None, cache_dir=None,
+                    chunksize=None, incremental=False, profile=False, profile_dir=None, timestep='auto',
+                    min_completeness=None, fit_cache=None, fit_cache_size=fitcache.MAX_BYTES,
+                    return_periods=(2, 5, 10, 25, 50, 100, 200), ci_method='bootstrap', series=None):
+    """
+    Extract the AMS of one station, construct its IDF and save both to savepath/<station>.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the station time series .csv file.
+        savepath: str, directory where the per-station output directories are created.
+        durations, ftype, timestep, min_completeness: see AMS and AMS.calculate_AMS.
+        ci, number_bootstrap, alpha, method, seed, fit_cache, fit_cache_size, return_periods, ci_method: see IDF.
+        figformat: str, figure file format. The figure is not drawn if None.
+        cache_dir: str, directory of the parsed time series cache, see AMS.
+        chunksize: int, number of records read at a time, see AMS.
+        incremental: bool, reuse the results of the last run of the station, see incremental.
+        profile: bool, record the time and memory of each stage, see profiling.
+        profile_dir: str, directory where the cProfile statistics of each stage are dumped.
+        series: tuple, records of the station already read by load_station, path is only used
+                for the station name then. Not used with incremental or chunksize.
+    Output:
+        idf: DataFrame, IDF table of the station.
+        ams: DataFrame, AMS table of the station.
+        records: list of dict, profiling record of each stage, empty if not profile.
+    """
+    if profile:
+        with profiling.profile(cprofile_dir=profile_dir) as profiler:
+            profiler.labels['station'] = station_name(path)
+            idf, out, _ = process_station(path, savepath, durations, ftype, ci=ci,
+                                     number_bootstrap=number_bootstrap, alpha=alpha, method=method,
+                                     seed=seed, figformat=figformat, cache_dir=cache_dir,
+                                     chunksize=chunksize, incremental=incremental, timestep=timestep,
+                                     min_completeness=min_completeness, fit_cache=fit_cache,
+                                     fit_cache_size=fit_cache_size, return_periods=return_periods,
+                                     ci_method=ci_method, series=series)
+        return idf, out, profiler.records
+
+    outpath = os.path.join(savepath, station_name(path))
+    if incremental:
+        os.makedirs(outpath, exist_ok=True)
+        out, data, updated = update_station(path, outpath, durations, ftype, ci=ci,
+                                            number_bootstrap=number_bootstrap, alpha=alpha,
+                                            seed=seed, method=method, cache_dir=cache_dir,
+                                            timestep=timestep, min_completeness=min_completeness,
+                                            fit_cache=fit_cache, fit_cache_size=fit_cache_size,
+                                            return_periods=return_periods, ci_method=ci_method)
+    else:
+        if series is None or chunksize is not None:
+            source = path
+        else:
+            with profiling.stage('load', prefetched=True):
+                source = cache.series_frame(*series)
+        out, completeness = AMS(source, durations, cache_dir=cache_dir, chunksize=chunksize,
+                                timestep=timestep).calculate_AMS(ftype, min_completeness=min_completeness,
+                                                                 return_completeness=True)
+
+        os.makedirs(outpath, exist_ok=True)
+        out.to_csv("{}/AMS.csv".format(outpath))
+        completeness.to_csv("{}/completeness.csv".format(outpath))
+
+        data = IDF(out, ci, number_bootstrap, alpha, seed=seed, method=method,
+                   fit_cache=fit_cache, fit_cache_size=fit_cache_size, return_periods=return_periods,
+                   ci_method=ci_method)
+        data.construct_IDF()
+        data.idf.to_csv("{}/IDF.csv".format(outpath))
+
+    if figformat is not None:
+        data.plot_IDF(outpath, figformat)
+
+    return data.idf, out, []
+
+
+def run_batch(paths, savepath, n_workers=1, retries=1, profile=None, defer_plots=False, store=None,
+              prefetch=0, **options):
+    """
+    Process many stations in parallel and consolidate their results.
+
+    Stations that raise an error are submitted again up to retries times, and skipped
+    afterwards. Progress is printed as stations are completed. The consolidated IDF
+    table is saved to savepath/summary.csv and the stations that could not be
+    processed to savepath/failures.csv. If profile is given, the profiling records of
+    all stations are saved there as JSON, labelled by station.
+
+    With defer_plots, the workers only compute the IDF tables, and the figures are
+    drawn from the saved IDF.csv files once all stations are done, see plotting.
+    If store is given, the AMS and IDF of each station are also appended to that
+    consolidated store as stations are completed, see store. A station that could not
+    be appended to the store is reported but kept in the summary, not processed again.
+
+    With prefetch, the station files are read in a background thread of this process,
+    prefetch stations ahead of the workers, and the workers receive the parsed records
+    (see Prefetcher). Reading, decompressing and parsing the next files then overlaps
+    with the fits, and at most prefetch + 2 * n_workers stations are held in memory.
+    The read is then profiled in the prefetch thread, as a load stage labelled prefetched.
+    Otherwise all stations are submitted at once and each worker reads its own file.
+
+    Parameters
+    ----------
+    Input:
+        paths: list of str, station time series files, see find_stations.
+        savepath: str, directory where all outputs are saved.
+        n_workers: int, number of worker processes.
+        retries: int, number of times a failed station is submitted again.
+        profile: str, path of the profiling report, see profiling.
+        defer_plots: bool, draw the figures as a separate stage after all stations.
+        store: str, directory of a ResultStore.
+        prefetch: int, number of station files read ahead of the workers, 0 to not prefetch.
+                  Ignored with incremental or chunksize, which read the files themselves.
+        options: keyword arguments passed to process_station.
+    Output:
+        summary: DataFrame, IDF tables of all stations, with a "station" and a "return_period" column.
+        failures: DataFrame, station, path, number of attempts and error of the stations skipped.
+    """
+    os.makedirs(savepath, exist_ok=True)
+
+    options['profile'] = profile is not None
+    figformat = options.get('figformat')
+    if defer_plots:
+        options['figformat'] = None
+    results = {}
+    records = []
+    failures = []
+    store_errors = {}
+    attempts = {path: 0 for path in paths}
+    start = time.time()
+    results_store = ResultStore(store) if store is not None else None
+    if options.get('incremental') or options.get('chunksize') is not None:
+        prefetch = 0
+    load = functools.partial(prefetch_station, cache_dir=options.get('cache_dir'),
+                             profile=profile is not None)
+
+    with ProcessPoolExecutor(max_workers=n_workers) as pool, \
+            Prefetcher(paths if prefetch else [], load, depth=prefetch) as loaded:
+        def submit(path, series=None):
+            attempts[path] += 1
+            return pool.submit(process_station, path, savepath, series=series, **options)
+
+        def prefetched():
+            for path, series, _ in loaded:
+                # A station that could not be read is submitted without records, so that its
+                # worker reads it again and the error is handled as any other.
+                if series is None:
+                    yield path, None
+                else:
+                    records.extend(series[1])
+                    yield path, series[0]
+
+        if prefetch:
+            stations = prefetched()
+            limit = 2 * n_workers
+        else:
+            stations = ((path, None) for path in paths)
+            limit = len(paths)
+
+        pending = {}
+
+        def fill():
+            while len(pending) < limit:
+                path, series = next(stations, (None, None))
+                if path is None:
+                    return
+                pending[submit(path, series)] = path
+
+        fill()
+        while pending:
+            completed, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in completed:
+                path = pending.pop(future)
+                try:
+                    results[path], ams, station_records = future.result()
+                    records.extend(station_records)
+                except Exception:
+                    error = traceback.format_exc().strip().splitlines()[-1]
+                    if attempts[path] <= retries:
+                        pending[submit(path)] = path
+                        continue
+                    failures.append({'station': station_name(path), 'path': path,
+                                     'attempts': attempts[path], 'error': error})
+                else:
+                    # The station succeeded and its csv files are saved, so a store
+                    # error is reported without processing the station again.
+                    if results_store is not None:
+                        try:
+                            results_store.append(station_name(path), results[path], ams)
+                        except Exception:
+                            error = traceback.format_exc().strip().splitlines()[-1]
+                            store_errors[path] = error
+
+                done = len(results) + len(failures)
+                rate = done / max(time.time() - start, 1e-9)
+                sys.stdout.write("\r{}/{} stations, {} failed, {:.2f} stations/s".format(
+                    done, len(paths), len(failures), rate))
+                sys.stdout.flush()
+            fill()
+    sys.stdout.write("\n")
+    for path, error in store_errors.items():
+        print("Could not store {}: {}".format(station_name(path), error))
+
+    tables = []
+    for path in paths:
+        if path in results:
+            idf = results[path].rename_axis('return_period').reset_index()
+            idf.insert(0, 'station', station_name(path))
+            tables.append(idf)
+    summary = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(
+        columns=['station', 'return_period'])
+    summary.to_csv(os.path.join(savepath, 'summary.csv'), index=False)
+
+    failures = pd.DataFrame(
+        failures, columns=['station', 'path', 'attempts', 'error'])
+    failures.to_csv(os.path.join(savepath, 'failures.csv'), index=False)
+
+    if defer_plots and figformat is not None:
+        jobs = [(os.path.join(savepath, station_name(path), 'IDF.csv'),
+                 os.path.join(savepath, station_name(path), 'Figure.{}'.format(figformat)))
+                for path in paths if path in results]
+        errors = plotting.render_figures(jobs, n_workers)
+        for figure, error in errors.items():
+            print("Could not draw {}: {}".format(figure, error))
+
+    if profile is not None:
+        profiler = profiling.Profiler()
+        profiler.records = records
+        profiler.save(profile)
+
+    return summary, failures
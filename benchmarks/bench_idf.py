@@ -0,0 +1,238 @@
+"""
+File name: bench_idf
+
+##############################
+
+Purpose:
+
+Benchmark each stage of the IDF construction (parse, AMS, fit, CI, plot)
+on reproducible synthetic hourly stations, and compare the timings
+against a stored baseline to catch performance regressions.
+
+"""
+
+import pandas as pd
+import numpy as np
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from constructIDF import AMS, IDF  # noqa: E402
+
+
+def synthetic_station(path, years, gap_fraction, seed=0, start='1950-01-01'):
+    """
+    Write a synthetic hourly rainfall time series in the format read by AMS.
+
+    Rain falls in about 10% of the hours with gamma distributed depths, and gap_fraction
+    of the hours are missing (NaN). The same arguments always give the same file.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path of the .csv file to write.
+        years: int, length of the record in years.
+        gap_fraction: float, fraction of missing hours.
+        seed: int, seed of the random number generator.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=int(years * 8766), freq='60min')
+    values = np.round(rng.gamma(0.3, 0.1, len(dates)), 2)
+    values[rng.random(len(dates)) > 0.1] = 0.0
+    values[rng.random(len(dates)) < gap_fraction] = np.nan
+    pd.DataFrame({'date': dates, 'val': values, 'qflags': np.nan,
+                  'mflags': np.nan}).to_csv(path)
+
+
+def measure(function, repeat):
+    """
+    Best wall time over repeat calls of function, and peak traced memory of one more call.
+
+    Output:
+        result: return value of the last call.
+        seconds: float, best wall time.
+        peak_mb: float, peak memory allocated during the call, in MB.
+    """
+    seconds = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 1e6
+
+
+def run_case(workdir, years, gap_fraction, durations, number_bootstrap, ftype, method, repeat, plot,
+             engines=False):
+    """
+    Benchmark every stage of one synthetic station.
+
+    If engines, the AMS are also computed with record-count windows (timestep=None) by the
+    vectorized engine ("ams_records" stage) and by the reference engine ("ams_reference" stage),
+    which give the same values, and the speedup of the vectorized engine is reported.
+
+    Output:
+        list of dict, one record per stage.
+    """
+    path = os.path.join(workdir, 'station_{}y_{}.csv'.format(years, gap_fraction))
+    if not os.path.exists(path):
+        synthetic_station(path, years, gap_fraction)
+
+    stages = [('parse', lambda: AMS(path, durations)),
+              ('ams', lambda: ts.calculate_AMS(ftype)),
+              ('fit', lambda: fit(out, False))]
+    if engines:
+        stages[2:2] = [('ams_records', lambda: records_ams('vectorized')),
+                       ('ams_reference', lambda: records_ams('reference'))]
+    if number_bootstrap:
+        stages.append(('ci', lambda: fit(out, True)))
+    if plot:
+        stages.append(('plot', lambda: draw(data)))
+
+    def fit(ams, ci):
+        data = IDF(ams, ci, number_bootstrap, 0.9, seed=0, method=method)
+        data.construct_IDF()
+        return data
+
+    def records_ams(engine):
+        return series.calculate_AMS(ftype, engine=engine)
+
+    def draw(data):
+        data.plot_IDF(workdir, 'png')
+
+    case = {'years': years, 'gap_fraction': gap_fraction, 'durations': list(durations),
+            'number_bootstrap': number_bootstrap, 'ftype': ftype, 'method': method}
+    records = []
+    ts = series = out = data = None
+    for stage, function in stages:
+        result, seconds, peak_mb = measure(function, repeat)
+        if stage == 'parse':
+            ts = result
+            # Built once so the engines are timed on the AMS extraction alone.
+            series = AMS(ts.reformatted_frame, durations, timestep=None) if engines else None
+        elif stage == 'ams':
+            out = result.copy()
+        elif stage in ('fit', 'ci'):
+            data = result
+        records.append(dict(case, stage=stage, seconds=seconds, peak_mb=peak_mb))
+        print("{:>3}y gaps={:<5} {:<13} {:9.4f} s {:9.1f} MB".format(
+            years, gap_fraction, stage, seconds, peak_mb))
+    if engines:
+        timed = {record['stage']: record for record in records}
+        speedup = timed['ams_reference']['seconds'] / max(timed['ams_records']['seconds'], 1e-12)
+        timed['ams_reference']['speedup'] = speedup
+        print("{:>3}y gaps={:<5} vectorized engine {:.0f}x faster than reference".format(
+            years, gap_fraction, speedup))
+    return records
+
+
+def record_key(record):
+    return json.dumps({k: v for k, v in record.items() if k not in ('seconds', 'peak_mb', 'speedup')},
+                      sort_keys=True)
+
+
+def compare(records, baseline, tolerance):
+    """
+    Compare the timings with a baseline.
+
+    Parameters
+    ----------
+    Input:
+        records: list of dict, results of this run.
+        baseline: list of dict, results of a previous run, see --save-baseline.
+        tolerance: float, relative slowdown above which a stage is reported as a regression.
+    Output:
+        list of dict, records of this run slower than the baseline by more than tolerance.
+    """
+    reference = {record_key(r): r for r in baseline}
+    regressions = []
+    for record in records:
+        previous = reference.get(record_key(record))
+        if previous is None:
+            continue
+        record['baseline_seconds'] = previous['seconds']
+        record['ratio'] = record['seconds'] / max(previous['seconds'], 1e-12)
+        if record['ratio'] > 1 + tolerance:
+            regressions.append(record)
+    return regressions
+
+
+def main(args):
+    durations = [int(d) for d in args.durations.split(',')]
+    workdir = args.workdir or tempfile.mkdtemp(prefix='bench_idf_')
+    os.makedirs(workdir, exist_ok=True)
+
+    records = []
+    for years, gap_fraction, number_bootstrap in itertools.product(args.years, args.gaps, args.bootstrap):
+        records.extend(run_case(workdir, years, gap_fraction, durations, number_bootstrap,
+                                args.ftype, args.method, args.repeat, not args.no_plot, args.engines))
+
+    report = {'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                          'numpy': np.__version__, 'pandas': pd.__version__},
+              'results': records}
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(records, json.load(f)['results'], args.tolerance)
+        report['regressions'] = regressions
+        for r in regressions:
+            print("REGRESSION {:>3}y gaps={} {}: {:.4f} s, baseline {:.4f} s ({:.2f}x)".format(
+                r['years'], r['gap_fraction'], r['stage'], r['seconds'], r['baseline_seconds'], r['ratio']))
+        status = 1 if regressions else 0
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Benchmark the AMS extraction and IDF fitting on synthetic hourly stations")
+
+    parser.add_argument("--years", default=[10, 60], type=int, nargs='+',
+                        help="Lengths of the synthetic records in years, default 10 60")
+    parser.add_argument("--gaps", default=[0.0, 0.1], type=float, nargs='+',
+                        help="Fractions of missing hours, default 0 0.1")
+    parser.add_argument("--durations", default="1,2,3,6,12,24,48,72", type=str,
+                        help="Comma separated durations in hours, default 1,2,3,6,12,24,48,72")
+    parser.add_argument("--bootstrap", default=[100], type=int, nargs='+',
+                        help="Numbers of bootstrap samples of the CI stage, 0 skips it, default 100")
+    parser.add_argument("--ftype", default="sliding", type=str,
+                        help="Type of approach, 'sliding' or 'fixed', default sliding")
+    parser.add_argument("--method", default="mle", type=str,
+                        help="GEV estimator, 'mle', 'lmoments' or 'pwm', default mle")
+    parser.add_argument("--repeat", default=1, type=int,
+                        help="Each stage is timed this many times and the best time is kept, default 1")
+    parser.add_argument("--engines", action="store_true",
+                        help="Also time the vectorized and reference engines on record-count windows")
+    parser.add_argument("--no-plot", action="store_true",
+                        help="Skip the plot stage")
+    parser.add_argument("--workdir", default=None, type=str,
+                        help="Directory for the synthetic stations and figures, a temporary directory by default")
+    parser.add_argument("--output", default="bench_results.json", type=str,
+                        help="Path of the JSON results file, default bench_results.json")
+    parser.add_argument("--baseline", default=None, type=str,
+                        help="JSON results of a previous run to compare against")
+    parser.add_argument("--tolerance", default=0.2, type=float,
+                        help="Relative slowdown reported as a regression, default 0.2")
+    parser.add_argument("--save-baseline", default=None, type=str,
+                        help="Also save the results of this run as a baseline to this path")
+
+    args = parser.parse_args()
+
+    sys.exit(main(args))
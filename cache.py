@@ -0,0 +1,162 @@
+"""
+File name: cache
+
+##############################
+
+Purpose:
+
+Keep a binary copy of each parsed station time series so the
+csv file, and its dates, are only parsed once.
+
+Each station is stored in its own directory inside the cache directory,
+with the dates as int32 minutes since 1970-01-01 and the rainfall values
+as float64, both in .npy files that are loaded memory-mapped. The directory
+name is made of a hash of the file path and a hash of its modification time and
+size, so an entry is invalidated as soon as the file changes.
+
+"""
+
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+
+FLAG_COLUMNS = ('qflags', 'mflags')
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+
+def cache_entry(path, cache_dir):
+    """
+    Directory of the cache entry of a station file in its current version.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the station time series .csv file.
+        cache_dir: str, cache directory.
+    Output:
+        str, path of the cache entry directory.
+    """
+    stat = os.stat(path)
+    source = _digest(os.path.abspath(path))
+    version = _digest("{}:{}".format(stat.st_mtime_ns, stat.st_size))
+    return os.path.join(cache_dir, "{}-{}".format(source, version))
+
+
+def parse_series(path):
+    """
+    Parse a station time series .csv file, see AMS for the expected format.
+
+    Output:
+        minutes: numpy array, int32 minutes since 1970-01-01 of each record.
+        values: numpy array, float64 rainfall value of each record.
+        column: str, name of the rainfall values column.
+    """
+    ts = pd.read_csv(path, index_col=0, parse_dates=['date'],
+                     usecols=lambda c: c not in FLAG_COLUMNS)
+    column = ts.columns.drop('date')[0]
+    minutes = ts.date.values.astype('datetime64[m]').astype(np.int64)
+    return minutes.astype(np.int32), ts[column].values.astype(np.float64), column
+
+
+def series_frame(minutes, values, column):
+    """
+    Time series DataFrame in the format read by AMS from parsed records, see parse_series.
+    """
+    return pd.DataFrame({
+        'date': pd.to_datetime(np.asarray(minutes, dtype=np.int64), unit='m'),
+        column: np.asarray(values)})
+
+
+def load_series(path, cache_dir):
+    """
+    Load a station time series from the cache, parsing and caching it first if needed.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the station time series .csv file.
+        cache_dir: str, cache directory, created if it does not exist.
+    Output:
+        minutes: numpy memmap, int32 minutes since 1970-01-01 of each record.
+        values: numpy memmap, float64 rainfall value of each record.
+        column: str, name of the rainfall values column.
+    """
+    entry = cache_entry(path, cache_dir)
+    if not os.path.isdir(entry):
+        write_entry(path, entry)
+
+    with open(os.path.join(entry, 'meta.json')) as f:
+        meta = json.load(f)
+    minutes = np.load(os.path.join(entry, 'minutes.npy'), mmap_mode='r')
+    values = np.load(os.path.join(entry, 'values.npy'), mmap_mode='r')
+    return minutes, values, meta['column']
+
+
+def write_entry(path, entry):
+    """
+    Parse a station file into the cache entry directory and remove its outdated entries.
+    """
+    save_entry(path, entry, *parse_series(path))
+
+
+def save_series(path, cache_dir, minutes, values, column):
+    """
+    Cache a station time series already parsed, e.g. by ingest, without reading its csv file.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the station time series .csv file, written with these records.
+        cache_dir: str, cache directory, created if it does not exist.
+        minutes, values, column: see parse_series.
+    """
+    entry = cache_entry(path, cache_dir)
+    if not os.path.isdir(entry):
+        save_entry(path, entry, np.asarray(minutes, dtype=np.int32),
+                   np.asarray(values, dtype=np.float64), column)
+
+
+def write_atomic(path, write, suffix=''):
+    """
+    Write a file or directory so that concurrent readers never see a partial entry.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path of the entry.
+        write: function, called with a temporary path next to path where the entry is written,
+               which is then renamed to path.
+        suffix: str, ending of path kept at the end of the temporary path, e.g. ".npy" for np.save.
+    """
+    tmp = "{}.tmp{}{}".format(path[:len(path) - len(suffix)], os.getpid(), suffix)
+    write(tmp)
+    try:
+        os.replace(tmp, path)
+    except OSError:
+        # A directory is already there, another process wrote the same entry in the meantime.
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def save_entry(path, entry, minutes, values, column):
+    """
+    Save parsed records into the cache entry directory of a station file and remove its outdated entries.
+    """
+    def write(tmp):
+        os.makedirs(tmp, exist_ok=True)
+        np.save(os.path.join(tmp, 'minutes.npy'), minutes)
+        np.save(os.path.join(tmp, 'values.npy'), values)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'source': os.path.abspath(path), 'column': column}, f)
+    write_atomic(entry, write)
+
+    cache_dir, name = os.path.split(entry)
+    source = name.split('-')[0]
+    for other in os.listdir(cache_dir):
+        if other.startswith(source + '-') and other != name and '.tmp' not in other:
+            shutil.rmtree(os.path.join(cache_dir, other), ignore_errors=True)
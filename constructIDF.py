@@ -12,11 +12,234 @@ Generate IDF curves from hourly data
 """
 
 from scipy.stats import genextreme as gev
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
+from scipy.stats import norm
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import argparse
 import numpy as np
+import warnings
+import lmoments
+import cache
+import fitcache
+import plotting
+import profiling
+
+
+# Durations with fewer years of AMS are not fitted.
+MIN_YEARS = 3
+
+
+def fit_gev_rows(samples, method='mle', start=None):
+    """
+    Fit a GEV distribution to each row of a 2D array of samples.
+
+    Parameters
+    ----------
+    Input:
+        samples: numpy array, (number of samples, sample size).
+        method: str, "mle" for scipy maximum likelihood started from the L-moments estimate,
+                "lmoments" or "pwm" for the closed form estimators in lmoments, which fit
+                all rows at once.
+        start: numpy array, (number of samples, 3) starting parameters of the maximum likelihood
+                optimizer, e.g. a previous fit. The L-moments estimate is used instead when it has
+                a higher likelihood, or when start does not cover every value of the sample.
+    Output:
+        numpy array, (number of samples, 3) GEV (shape, location, scale) parameters. With "lmoments"
+        and "pwm", rows without a valid fit, e.g. resamples of a single repeated value, are NaN for both.
+    """
+    if method in ('lmoments', 'pwm'):
+        fits = lmoments.fit_gev(samples, method).reshape(-1, 3)
+        # A sample of a single repeated value has no GEV fit, whatever the estimator returns.
+        tied = np.ptp(np.reshape(samples, (len(fits), -1)), axis=1) == 0
+        fits[tied | ~(np.isfinite(fits).all(axis=1) & (fits[:, 2] > 0))] = np.nan
+        return fits
+    elif method != 'mle':
+        raise ValueError("method must be either 'mle', 'lmoments' or 'pwm'")
+
+    starts = [lmoments.fit_gev(samples)]
+    if start is not None:
+        starts.insert(0, np.reshape(start, (-1, 3)))
+    fits = np.empty((len(samples), 3))
+    for i, (row, candidates) in enumerate(zip(samples, zip(*starts))):
+        nnlf = [gev.nnlf(c, row) if np.all(np.isfinite(c)) and c[2] > 0 else np.inf
+                for c in candidates]
+        if np.isfinite(min(nnlf)):
+            best = candidates[int(np.argmin(nnlf))]
+            fits[i] = gev.fit(row, best[0], loc=best[1], scale=best[2])
+        else:
+            fits[i] = gev.fit(row)
+    return fits
+
+
+def return_levels(params, quantiles, covariance=None):
+    """
+    GEV return levels for every set of parameters and exceedance probability at once.
+
+    Parameters
+    ----------
+    Input:
+        params: numpy array, (..., 3) GEV (shape, location, scale) parameters, in the scipy
+                genextreme convention.
+        quantiles: list of float, annual exceedance probabilities, 1 / return period.
+        covariance: numpy array, (..., 3, 3) covariance of the parameters, see gev_covariance.
+    Output:
+        levels: numpy array, (..., len(quantiles)) return levels, equal to gev.isf.
+        se: numpy array, (..., len(quantiles)) standard errors of the return levels by the
+            delta method, only returned if covariance is given.
+    """
+    params = np.asarray(params, dtype=float)
+    c, loc, scale = (params[..., k, np.newaxis] for k in range(3))
+    log_y = np.log(-np.log1p(-np.asarray(quantiles, dtype=float)))
+    small = np.abs(c) < 1e-9
+    c_safe = np.where(small, 1.0, c)
+    # Derivative of the level with respect to scale, (1 - y^c) / c, -log(y) as c tends to 0.
+    growth = np.where(small, -log_y, -np.expm1(c * log_y) / c_safe)
+    levels = loc + scale * growth
+    if covariance is None:
+        return levels
+
+    d_shape = np.where(small, -scale * log_y ** 2 / 2,
+                       -scale * (growth + np.exp(c * log_y) * log_y) / c_safe)
+    gradient = np.stack([d_shape, np.ones_like(levels), growth], axis=-1)
+    variance = np.einsum('...rk,...kl,...rl->...r', gradient, covariance, gradient)
+    with np.errstate(invalid='ignore'):
+        return levels, np.sqrt(variance)
+
+
+def gev_nll(samples, params):
+    """
+    GEV negative log-likelihood of each row of samples, NaN values are left out.
+
+    Parameters
+    ----------
+    Input:
+        samples: numpy array, (number of samples, sample size).
+        params: numpy array, (..., number of samples, 3) GEV (shape, location, scale) parameters.
+    Output:
+        numpy array, (..., number of samples) negative log-likelihoods, inf outside the support.
+    """
+    c, loc, scale = (params[..., k, np.newaxis] for k in range(3))
+    small = np.abs(c) < 1e-9
+    with np.errstate(all='ignore'):
+        s = (samples - loc) / scale
+        t = 1 - c * s
+        # y = -log(t) / c, so that t ** (1 / c) = exp(-y), and y = s as c tends to 0.
+        y = np.where(small, s, -np.log(t) / np.where(small, 1.0, c))
+        logpdf = -np.log(scale) - np.exp(-y) - (1 - c) * y
+        logpdf = np.where((t > 0) & (scale > 0), logpdf, -np.inf)
+    return -np.where(np.isnan(samples), 0.0, logpdf).sum(axis=-1)
+
+
+def gev_covariance(samples, params, step=1e-4):
+    """
+    Covariance of maximum likelihood GEV parameters, the inverse of the observed information.
+
+    The Hessian of the negative log-likelihood is approximated by central differences, for
+    every row at once.
+
+    Parameters
+    ----------
+    Input:
+        samples: numpy array, (number of samples, sample size), NaN values are left out.
+        params: numpy array, (number of samples, 3) maximum likelihood fit of each row.
+        step: float, relative step of the finite differences.
+    Output:
+        numpy array, (number of samples, 3, 3) covariances, NaN where the Hessian is singular.
+    """
+    params = np.asarray(params, dtype=float)
+    h = step * np.maximum(np.abs(params), 1e-2)
+    # steps[i, n] moves parameter i of row n by h[n, i]
+    steps = np.eye(3)[:, np.newaxis, :] * h.T[:, :, np.newaxis]
+    signs = np.array([(1, 1), (1, -1), (-1, 1), (-1, -1)], dtype=float)
+    shifted = (params + signs[:, 0, None, None, None, None] * steps[None, :, None] +
+               signs[:, 1, None, None, None, None] * steps[None, None, :])
+    nll = gev_nll(samples, shifted)
+    # Rows that were not fitted (NaN params) give a NaN covariance.
+    with np.errstate(invalid='ignore'):
+        hessian = (nll[0] - nll[1] - nll[2] + nll[3]) / (4 * h.T[:, None] * h.T[None, :])
+    hessian = np.moveaxis(hessian, -1, 0)
+
+    covariance = np.full_like(hessian, np.nan)
+    invertible = np.isfinite(hessian).all(axis=(1, 2))
+    invertible[invertible] = np.abs(np.linalg.det(hessian[invertible])) > 0
+    covariance[invertible] = np.linalg.inv(hessian[invertible])
+    return covariance
+
+
+def share_array(array):
+    """
+    Copy an array to a new shared memory block.
+
+    Output:
+        shm: SharedMemory, the block, to be closed and unlinked by the caller.
+        spec: tuple, (name, shape, dtype) to attach to the block with attach_array.
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """
+    Attach to an array shared with share_array, without copying it.
+
+    Output:
+        shm: SharedMemory, the block, to be closed once the array is no longer used.
+        array: numpy array backed by the block.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def fit_shared_rows(index_spec, ams_spec, column, rows, method='mle', start=None):
+    """
+    Fit a GEV distribution to bootstrap resamples of one AMS column held in shared memory.
+
+    Parameters
+    ----------
+    Input:
+        index_spec: tuple, shared (number of resamples, years) matrix of resample indices.
+        ams_spec: tuple, shared (years, durations) AMS matrix.
+        column: int, column of the AMS matrix to resample.
+        rows: slice, resamples to fit.
+        method, start: see fit_gev_rows.
+    Output:
+        numpy array, (number of resamples in rows, 3) GEV (shape, location, scale) parameters.
+    """
+    index_shm, index = attach_array(index_spec)
+    ams_shm, ams = attach_array(ams_spec)
+    try:
+        samples = ams[index[rows], column]
+    finally:
+        del index, ams
+        index_shm.close()
+        ams_shm.close()
+    return fit_gev_rows(samples, method, start)
+
+
+def reject_incomplete(ams, completeness, min_completeness):
+    """
+    Set to NaN the annual maxima of the years below a completeness threshold.
+
+    Parameters
+    ----------
+    Input:
+        ams: DataFrame, AMS with a "year" column and one column per duration, see AMS.calculate_AMS.
+        completeness: DataFrame, completeness of each year and duration in the same layout.
+        min_completeness: float, minimum completeness of a year, between 0 and 1, or dict of
+                float per duration column. Durations missing from the dict are kept whole.
+    Output:
+        DataFrame, copy of ams without the rejected maxima.
+    """
+    ams = ams.copy()
+    if not isinstance(min_completeness, dict):
+        min_completeness = dict.fromkeys(ams.columns.drop('year'), min_completeness)
+    aligned = completeness.set_index('year').reindex(ams.year)
+    for col, threshold in min_completeness.items():
+        ams.loc[aligned[col].values < threshold, col] = np.nan
+    return ams
 
 
 class AMS:
@@ -43,42 +266,444 @@ class AMS:
     Type of data accepted:
        DataFrame, rainfall time series in a pandas two column dataframe format. One column should be the "date"
        of the record (i.e. "1960-05-24 00:00:00" if hourly records), and the second must be the rainfall values.
+
+    path is the path to a .csv file (which may be gzip compressed, e.g. "station.csv.gz"), or
+    the DataFrame itself, e.g. already read by batch.load_station.
+
+    If cache_dir is given, the parsed time series is loaded from a binary copy kept in that
+    directory (see cache), and the csv file is only parsed the first time or after it changes.
+
+    If chunksize is given, the time series is never loaded as a whole: it is read chunksize
+    records at a time and the annual maxima are updated after each chunk (see RunningMaxima).
+    In that case path can also be an iterable of DataFrames in the format above.
+
+    Durations are given as timedeltas, strings such as "15min" or "24H", or integers taken as
+    hours. The records are placed on a regular grid of time steps, timestep="auto" (default)
+    infers the time step from the dates, so sub-hourly, daily and gappy records all give windows
+    of the right length in time (see grid_maxima). With timestep=None and integer durations,
+    durations are instead numbers of records, summed over the windows of sliding_max and
+    fixed_max, which assume hourly records without gaps. The reference engine always uses
+    these windows.
     """
 
-    def __init__(self, path, durations):
+    def __init__(self, path, durations, cache_dir=None, chunksize=None, timestep='auto'):
 
         self.path = path
         self.durations = durations
-        self.reformat()
-        self.output = pd.DataFrame(
-            self.reformatted_frame.date.dt.year.unique(), columns=['year'])
+        self.cache_dir = cache_dir
+        self.chunksize = chunksize
+        self.timestep = timestep
+        self.window_sums = None
+        if self.chunksize is None:
+            self.reformat()
+            self.output = pd.DataFrame(
+                self.reformatted_frame.date.dt.year.unique(), columns=['year'])
 
     def reformat(self):
-        ts = pd.read_csv(self.path, index_col=0, parse_dates=['date'])
-        self.reformatted_frame = ts.drop(['qflags', 'mflags'], axis=1)
+        if isinstance(self.path, pd.DataFrame):
+            # Already read, e.g. by the prefetch thread of batch, whose load stage is recorded there.
+            self.reformatted_frame = self.path.drop(
+                [c for c in cache.FLAG_COLUMNS if c in self.path], axis=1)
+            return
+        with profiling.stage('load', cached=self.cache_dir is not None):
+            if self.cache_dir is not None:
+                self.reformatted_frame = cache.series_frame(
+                    *cache.load_series(self.path, self.cache_dir))
+            else:
+                ts = pd.read_csv(self.path, index_col=0, parse_dates=['date'])
+                self.reformatted_frame = ts.drop(['qflags', 'mflags'], axis=1)
 
-    def calculate_AMS(self, ams_type):
+    def read_chunks(self):
+        """
+        Iterate over the time series in DataFrames of at most chunksize records.
+        """
+        if isinstance(self.path, str):
+            return pd.read_csv(self.path, index_col=0, parse_dates=['date'], chunksize=self.chunksize,
+                               usecols=lambda c: c not in cache.FLAG_COLUMNS)
+        return iter(self.path)
+
+    def calculate_AMS(self, ams_type, engine='vectorized', min_completeness=None, return_completeness=False):
         """
         Function to extract AMS from a time series.
 
+        The completeness of each year and duration (see annual_maxima) is computed along with the
+        maxima and kept in self.completeness.
+
+        Parameters
+        ----------
+        Input:
+            ams_type: str, either "sliding" for sliding maxima or "fixed" for fixed maxima.
+            engine: str, either "vectorized" (default) to compute the maxima of all durations in a single
+                    pass over the series, or "reference" to use the window by window sliding_max and fixed_max
+                    functions, whose durations are numbers of records. Both engines return the same values
+                    with timestep=None.
+            min_completeness: float or dict, the maxima of years below this completeness are set to NaN,
+                    see reject_incomplete. All years are kept if None.
+            return_completeness: bool, if True the completeness is returned along with the AMS.
+        Output:
+            rainfall annual maximum series in a pandas two column (year, AMS) dataframe format,
+            and the completeness in the same format if return_completeness.
+        """
+
+        with profiling.stage('ams', ams_type=ams_type, engine=engine):
+            if self.chunksize is not None:
+                if engine != 'vectorized':
+                    raise ValueError(
+                        "only the vectorized engine can read the records in chunks")
+                running = RunningMaxima(self.durations, ams_type,
+                                        AMS.on_grid(self.durations, self.timestep), self.timestep)
+                for chunk in self.read_chunks():
+                    running.update(chunk.date.values, chunk.drop(
+                        ['date'], axis=1).iloc[:, 0].values.astype(float))
+                maxima, completeness = running.finish()
+                self.output = maxima.reset_index()
+                self.completeness = completeness.reset_index()
+            elif engine == 'vectorized':
+                self.window_sums = AMS.window_sums(
+                    self.reformatted_frame, self.durations, ams_type, self.timestep)
+                maxima, completeness = self.window_sums.maxima(self.durations)
+                self.output = maxima.reindex(self.output.year).reset_index()
+                self.completeness = completeness.reindex(self.output.year).reset_index()
+            elif engine == 'reference':
+                # The reference engine sums numbers of records whatever the timestep.
+                if AMS.on_grid(self.durations):
+                    raise ValueError(
+                        "the reference engine only supports integer durations")
+                completeness = AMS.annual_maxima(
+                    self.reformatted_frame, self.durations, ams_type)[1]
+                self.completeness = completeness.reindex(self.output.year).reset_index()
+                for d in self.durations:
+                    with profiling.stage('ams_duration', duration=d):
+                        if ams_type == 'sliding':
+                            self.output[AMS.duration_label(d)] = self.reformatted_frame.groupby(pd.Grouper(key='date', freq='A')).agg(
+                                lambda x: AMS.sliding_max(x, d)).values
+                        elif ams_type == 'fixed':
+                            self.output[AMS.duration_label(d)] = self.reformatted_frame.groupby(pd.Grouper(key='date', freq='A')).agg(
+                                lambda x: AMS.fixed_max(x, d)).values
+            else:
+                raise ValueError(
+                    "engine must be either 'vectorized' or 'reference'")
+
+        if min_completeness is not None:
+            self.output = reject_incomplete(self.output, self.completeness, min_completeness)
+        if return_completeness:
+            return self.output, self.completeness
+        return self.output
+
+    def add_durations(self, durations, min_completeness=None):
+        """
+        Add durations to the AMS computed by calculate_AMS with the vectorized engine.
+
+        The cumulative sums built by calculate_AMS are kept in self.window_sums, so only the
+        windows of the new durations are summed. Durations already in the AMS are skipped.
+
+        Parameters
+        ----------
+        Input:
+            durations: list, durations to add, in the same form as the durations of the AMS.
+            min_completeness: float or dict, see calculate_AMS.
+        Output:
+            rainfall annual maximum series with a column for every duration, sorted by duration,
+            see calculate_AMS.
+        """
+        if self.window_sums is None:
+            raise ValueError(
+                "add_durations requires calculate_AMS to be run first with the vectorized engine")
+        new = [d for d in durations if AMS.duration_label(d) not in self.output.columns]
+
+        with profiling.stage('ams', ams_type=self.window_sums.ams_type, engine='vectorized'):
+            maxima, completeness = self.window_sums.maxima(new)
+        added = self.output.drop(columns=self.output.columns.drop('year'))
+        for d in new:
+            label = AMS.duration_label(d)
+            added[label] = maxima[label].reindex(self.output.year).values
+            self.completeness[label] = completeness[label].reindex(self.output.year).values
+        if isinstance(min_completeness, dict):
+            min_completeness = {col: threshold for col, threshold in min_completeness.items()
+                                if col in added.columns}
+        if min_completeness is not None:
+            added = reject_incomplete(added, self.completeness, min_completeness)
+
+        # Columns stay sorted by duration, as the IDF tables and figures expect.
+        self.durations = sorted(list(self.durations) + new, key=AMS.as_timedelta)
+        labels = ['year'] + [AMS.duration_label(d) for d in self.durations]
+        self.output = pd.concat([self.output, added.drop(columns=['year'])], axis=1)[labels]
+        self.completeness = self.completeness[labels]
+        return self.output
+
+    @staticmethod
+    def on_grid(durations, timestep=None):
+        """
+        Whether durations are windows in time on a regular grid, see grid_maxima, rather than numbers of records.
+        """
+        return timestep is not None or not all(isinstance(d, (int, np.integer)) for d in durations)
+
+    @staticmethod
+    def as_timedelta(duration):
+        """
+        Duration as a pandas Timedelta, integers are taken as hours.
+        """
+        if isinstance(duration, (int, np.integer)):
+            return pd.Timedelta(hours=int(duration))
+        return pd.Timedelta(duration)
+
+    @staticmethod
+    def duration_label(duration):
+        """
+        Column name of a duration in the AMS and IDF tables, e.g. "1H", "24H" or "15min".
+        """
+        if isinstance(duration, (int, np.integer)):
+            return f"{duration}H"
+        duration = AMS.as_timedelta(duration)
+        for unit, label in (('1H', 'H'), ('1min', 'min'), ('1s', 's')):
+            if duration % pd.Timedelta(unit) == pd.Timedelta(0):
+                return f"{duration // pd.Timedelta(unit)}{label}"
+        return str(duration)
+
+    @staticmethod
+    def time_step(dates):
+        """
+        Most frequent interval between consecutive records.
+
+        Parameters
+        ----------
+        Input:
+            dates: numpy datetime64 array, date of each record.
+        Output:
+            pandas Timedelta, time step of the records.
+        """
+        nanoseconds = np.sort(np.asarray(dates, dtype='datetime64[ns]').astype(np.int64))
+        steps = np.diff(nanoseconds)
+        steps = steps[steps > 0]
+        if len(steps) == 0:
+            raise ValueError("the time step cannot be inferred from less than two dates")
+        steps, counts = np.unique(steps, return_counts=True)
+        return pd.Timedelta(int(steps[np.argmax(counts)]), unit='ns')
+
+    @staticmethod
+    def year_steps(years, timestep):
+        """
+        Number of time steps of length timestep in each of the given years.
+        """
+        starts = (np.asarray(years, dtype=np.int64) - 1970).astype('datetime64[Y]')
+        lengths = (starts + 1).astype('datetime64[ns]') - starts.astype('datetime64[ns]')
+        return lengths.astype(np.int64) // pd.Timedelta(timestep).value
+
+    @staticmethod
+    def grid_matrix(dates, values, timestep, width):
+        """
+        Place a time series on a regular (year, time step) grid.
+
+        Column j of a year holds the rainfall recorded between j and j + 1 time steps after the
+        start of the year, so missing records are empty slots and windows are ranges of columns.
+        Records between two grid points are added to the slot before them, and missing values,
+        empty slots and the padding after the end of a year are set to zero, as in year_matrix.
+
         Parameters
         ----------
         Input:
+            dates: numpy datetime64 array, date of each record.
+            values: numpy array, rainfall value of each record.
+            timestep: pandas Timedelta, time step of the grid.
+            width: int, number of columns of the output array, at least the number of time steps in a year.
+        Output:
+            unique_years: numpy array, sorted years in the record.
+            matrix: numpy array, (len(unique_years), width) rainfall values.
+            recorded: numpy array, number of slots of each year holding a non missing value.
+        """
+        nanoseconds = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        if len(nanoseconds) == 0:
+            return np.array([], dtype=np.int64), np.zeros((0, width)), np.zeros(0, dtype=np.int64)
+        if np.any(nanoseconds[1:] < nanoseconds[:-1]):
+            order = np.argsort(nanoseconds, kind='stable')
+            nanoseconds, values, present = nanoseconds[order], values[order], present[order]
+
+        first, last = nanoseconds[[0, -1]].astype('datetime64[ns]').astype('datetime64[Y]')
+        calendar = np.arange(first, last + 2).astype('datetime64[ns]').astype(np.int64)
+        bounds = np.searchsorted(nanoseconds, calendar)
+        counts = np.diff(bounds)
+        in_record = counts > 0
+        unique_years = np.arange(first, last + 1)[in_record].astype(np.int64) + 1970
+
+        row = np.repeat(np.arange(in_record.sum()), counts[in_record])
+        slot = (nanoseconds - np.repeat(calendar[:-1][in_record], counts[in_record])) // timestep.value
+        shape = (len(unique_years), width)
+        matrix = np.bincount(row * width + slot, weights=values, minlength=shape[0] * width)
+        valid = np.bincount(row * width + slot, weights=present, minlength=shape[0] * width) > 0
+        return unique_years, matrix.reshape(shape), valid.reshape(shape).sum(axis=1)
+
+    @staticmethod
+    def grid_maxima(frame, durations, ams_type, timestep=None):
+        """
+        Sliding and fixed maxima for durations given in time, on a regular grid of time steps.
+
+        Sliding windows start at every time step of the year and fixed windows at every
+        multiple of the duration from the start of the year, each window spanning the duration.
+        Windows are truncated at the end of the year. The completeness of a year is the fraction
+        of its time steps that hold a value, see annual_maxima.
+
+        Parameters
+        ----------
+        Input:
+            frame: DataFrame, rainfall time series with a "date" column and a rainfall values column.
+            durations: list of timedeltas, strings or int (hours), each a multiple of the time step.
             ams_type: str, either "sliding" for sliding maxima or "fixed" for fixed maxima.
+            timestep: timedelta or str, time step of the records, inferred from the dates if None or "auto".
         Output:
-            rainfall annual maximum series in a pandas two column (year, AMS) dataframe format.
+            maxima: DataFrame indexed by year with one column of annual maxima per duration.
+            completeness: DataFrame indexed by year with one column of completeness per duration.
         """
+        return WindowSums(frame, ams_type, True, timestep).maxima(durations)
 
+    @staticmethod
+    def window_spec(ams_type, duration):
+        """
+        Windows visited by sliding_max and fixed_max for one duration.
+
+        Parameters
+        ----------
+        Input:
+            ams_type: str, either "sliding" or "fixed".
+            duration: int, duration over which AMS will be computed.
+        Output:
+            (length, stride, count): tuple of int, number of records summed in each window, offset between
+                    the first record of two consecutive windows and number of windows within a year.
+        """
         if ams_type == 'sliding':
-            for d in self.durations:
-                self.output[f"{d}H"] = self.reformatted_frame.groupby(pd.Grouper(key='date', freq='A')).agg(
-                    lambda x: AMS.sliding_max(x, d)).values
+            return duration + 2, 1, duration * int(np.floor(365 / duration))
         elif ams_type == 'fixed':
-            for d in self.durations:
-                self.output[f"{d}H"] = self.reformatted_frame.groupby(pd.Grouper(key='date', freq='A')).agg(
-                    lambda x: AMS.fixed_max(x, d)).values
+            return duration, duration, int(np.floor(24 * 365 / duration))
+        raise ValueError("ams_type must be either 'sliding' or 'fixed'")
 
-        return self.output
+    @staticmethod
+    def grid_spec(ams_type, duration, timestep, width):
+        """
+        Windows visited by grid_maxima for one duration, on a grid of width time steps per year.
+
+        Parameters
+        ----------
+        Input:
+            ams_type: str, either "sliding" or "fixed".
+            duration: timedelta, str or int (hours), a multiple of timestep.
+            timestep: pandas Timedelta, time step of the grid.
+            width: int, number of time steps per year of the grid.
+        Output:
+            (length, stride, count): tuple of int, see window_spec. The last windows are truncated at width.
+        """
+        length, remainder = divmod(AMS.as_timedelta(duration), timestep)
+        if remainder != pd.Timedelta(0) or not 1 <= length <= width:
+            raise ValueError("duration {} is not a multiple of the time step {} "
+                             "within a year".format(AMS.duration_label(duration), timestep))
+        length = int(length)
+        if ams_type == 'sliding':
+            return length, 1, width - length + 1
+        elif ams_type == 'fixed':
+            return length, length, -(-width // length)
+        raise ValueError("ams_type must be either 'sliding' or 'fixed'")
+
+    @staticmethod
+    def grid_width(timestep):
+        """
+        Number of time steps per year of the grid, enough for a leap year.
+        """
+        return int(-(-pd.Timedelta(days=366) // timestep))
+
+    @staticmethod
+    def year_matrix(dates, values, width):
+        """
+        Arrange a time series into a contiguous (year, record) float array.
+
+        Each row holds the first width records of one year in their original order, later records
+        are in no window. Missing values and the padding after the last record of a year are set to
+        zero, which gives the same window sums as np.nansum over a window truncated at the end of the year.
+
+        Parameters
+        ----------
+        Input:
+            dates: numpy datetime64 array, date of each record.
+            values: numpy array, rainfall value of each record.
+            width: int, number of columns of the output array.
+        Output:
+            unique_years: numpy array, sorted years in the record.
+            matrix: numpy array, (len(unique_years), width) rainfall values.
+            recorded: numpy array, number of records of each year holding a non missing value,
+                    over the whole year.
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        recorded = ~np.isnan(values)
+        values = np.where(recorded, values, 0.0)
+        if len(dates) == 0:
+            return np.array([], dtype=np.int64), np.zeros((0, width)), np.zeros(0, dtype=np.int64)
+
+        # Records are expected in time order, so the first record of each year
+        # is found by bisection. Otherwise records are sorted by year first.
+        if np.all(dates[1:] >= dates[:-1]):
+            keys = dates
+        else:
+            keys = dates.astype('datetime64[Y]')
+            order = np.argsort(keys, kind='stable')
+            keys, values, recorded = keys[order], values[order], recorded[order]
+
+        first, last = keys[[0, -1]].astype('datetime64[Y]')
+        calendar = np.arange(first, last + 2)
+        bounds = np.searchsorted(keys, calendar.astype(keys.dtype))
+        counts = np.diff(bounds)
+        present = counts > 0
+        unique_years = calendar[:-1][present].astype(np.int64) + 1970
+        counts = counts[present]
+
+        # The records of a year are contiguous, so each row is one slice copy. Only the columns
+        # the windows reach are copied, most of the year for short durations.
+        starts = bounds[:-1][present]
+        matrix = np.zeros((len(counts), width))
+        for row, (start, count) in enumerate(zip(starts, np.minimum(counts, width))):
+            matrix[row, :count] = values[start:start + count]
+        return unique_years, matrix, np.add.reduceat(recorded.astype(np.int64), starts)
+
+    @staticmethod
+    def annual_maxima(frame, durations, ams_type, timestep=None):
+        """
+        Vectorized sliding and fixed maxima for several durations.
+
+        The series is laid out as one row per year and accumulated once with a cumulative sum.
+        The sum over every window of a duration is then the difference of two strided views
+        of the cumulative sum, so no Python loop runs over the windows.
+
+        Missing values count as zero rainfall, as in np.nansum, so a year with many missing records
+        can have a low maximum. The completeness of a year is the fraction of its hours (of its time
+        steps on a grid) that hold a non missing record, over the whole year whatever the windows.
+        It is the same for every duration, so one min_completeness threshold means the same at
+        every duration.
+
+        Parameters
+        ----------
+        Input:
+            frame: DataFrame, rainfall time series with a "date" column and a rainfall values column.
+            durations: list of int, durations over which AMS will be computed. Durations in time
+                    are computed on a regular grid instead, see grid_maxima.
+            ams_type: str, either "sliding" for sliding maxima or "fixed" for fixed maxima.
+            timestep: timedelta or str, time step of the grid, see grid_maxima.
+        Output:
+            maxima: DataFrame indexed by year with one column of annual maxima per duration.
+            completeness: DataFrame indexed by year with one column of completeness, between 0 and 1,
+                    per duration.
+        """
+        if AMS.on_grid(durations, timestep):
+            return AMS.grid_maxima(frame, durations, ams_type, timestep)
+        return AMS.window_sums(frame, durations, ams_type).maxima(durations)
+
+    @staticmethod
+    def window_sums(frame, durations, ams_type, timestep=None):
+        """
+        Cumulative sums of a time series for the windows of durations, see WindowSums.
+        """
+        if AMS.on_grid(durations, timestep):
+            return WindowSums(frame, ams_type, True, timestep)
+        width = max([length + (count - 1) * stride for length, stride, count in
+                     (AMS.window_spec(ams_type, d) for d in durations)], default=0)
+        return WindowSums(frame, ams_type, width=width)
 
     @staticmethod
     def sliding_max(grouped_data, duration):
@@ -133,23 +758,367 @@ class AMS:
         return annual_maximum
 
 
+class RunningMaxima:
+
+    """
+    Annual maxima of several durations, updated one chunk of records at a time.
+
+    The windows are those of AMS.window_spec, or of AMS.grid_spec on a grid of time steps, and
+    give the same maxima and completeness as AMS.annual_maxima. Between chunks only the records
+    (grid slots) of the current year that still belong to a window not yet summed are kept, at
+    most max(durations) + 2 records, so memory is bounded by the chunk size and not by the length
+    of the record. Records must be in time order.
+
+    Parameters
+    ----------
+    Input:
+        durations: list, durations of the AMS, see AMS.
+        ams_type: str, either "sliding" for sliding maxima or "fixed" for fixed maxima.
+        on_grid: bool, if True durations are windows in time on a regular grid, see AMS.on_grid.
+        timestep: timedelta or str, time step of the grid, inferred from the first chunk if None or "auto".
+    """
+
+    def __init__(self, durations, ams_type, on_grid=False, timestep=None):
+        self.durations = durations
+        self.ams_type = ams_type
+        self.on_grid = on_grid
+        self.years = []
+        self.maxima = {d: [] for d in durations}
+        self.completeness = {d: [] for d in durations}
+        self.year = None
+        self.last_date = None
+        self.timestep = None
+        self.specs = None
+        if not on_grid:
+            self.specs = {d: AMS.window_spec(ams_type, d) for d in durations}
+        elif timestep not in (None, 'auto'):
+            self.set_timestep(pd.Timedelta(timestep))
+
+    def set_timestep(self, timestep):
+        self.timestep = timestep
+        width = AMS.grid_width(timestep)
+        self.specs = {d: AMS.grid_spec(self.ams_type, d, timestep, width) for d in self.durations}
+
+    def start_year(self, year):
+        self.year = year
+        self.year_start = np.datetime64(int(year) - 1970, 'Y').astype('datetime64[ns]').astype(np.int64)
+        # Position within the year of the first buffered record.
+        self.offset = 0
+        self.buffer = np.zeros(0)
+        self.evaluated = {d: 0 for d in self.specs}
+        self.running = {d: -np.inf for d in self.specs}
+        self.valid_slots = 0
+        self.last_valid = -1
+
+    def update(self, dates, values):
+        """
+        Add the next chunk of records.
+
+        Parameters
+        ----------
+        Input:
+            dates: numpy datetime64 array, date of each record.
+            values: numpy array, rainfall value of each record.
+        """
+        dates = np.asarray(dates, dtype='datetime64[ns]')
+        present = ~np.isnan(values)
+        values = np.where(present, values, 0.0)
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        if len(years) == 0:
+            return
+        if np.any(years[1:] < years[:-1]) or (self.year is not None and years[0] < self.year):
+            raise ValueError("records must be in time order")
+        nanoseconds = dates.astype(np.int64)
+        if self.on_grid:
+            if np.any(nanoseconds[1:] < nanoseconds[:-1]) or (
+                    self.last_date is not None and nanoseconds[0] < self.last_date):
+                raise ValueError("records must be in time order")
+            if self.specs is None:
+                self.set_timestep(AMS.time_step(dates))
+            self.last_date = nanoseconds[-1]
+
+        bounds = np.flatnonzero(np.diff(years)) + 1
+        for year, segment, segment_present, segment_dates in zip(
+                years[np.r_[0, bounds]], np.split(values, bounds), np.split(present, bounds),
+                np.split(nanoseconds, bounds)):
+            if year != self.year:
+                self.finish_year()
+                self.start_year(year)
+            if self.on_grid:
+                slots = (segment_dates - self.year_start) // self.timestep.value
+            else:
+                slots = self.offset + len(self.buffer) + np.arange(len(segment))
+            self.extend(slots, segment, segment_present)
+
+    def extend(self, slots, values, present):
+        """
+        Sum the windows of the current year that are complete once values are added at slots,
+        their positions within the year. present is True for the values that are not missing.
+        """
+        size = max(self.offset + len(self.buffer), slots[-1] + 1)
+        buffer = np.bincount(slots - self.offset, weights=values, minlength=size - self.offset)
+        buffer[:len(self.buffer)] += self.buffer
+        self.buffer = buffer
+
+        # Slots holding a value, the first one may already be counted with the previous chunk.
+        filled = np.unique(slots[present])
+        self.valid_slots += len(filled) - int(len(filled) > 0 and filled[0] == self.last_valid)
+        if len(filled):
+            self.last_valid = filled[-1]
+
+        # On a grid, the next chunk can still add records to the last slot.
+        seen = size - 1 if self.on_grid else size
+        cumulative = np.concatenate([[0.0], np.cumsum(self.buffer)])
+
+        keep = seen
+        for d, (length, stride, count) in self.specs.items():
+            first = self.evaluated[d]
+            last = min(count, (seen - length) // stride + 1) if seen >= length else 0
+            if last > first:
+                starts = np.arange(first, last) * stride - self.offset
+                window_sums = cumulative[starts + length] - cumulative[starts]
+                self.running[d] = max(self.running[d], window_sums.max())
+                self.evaluated[d] = last
+            if self.evaluated[d] < count:
+                keep = min(keep, self.evaluated[d] * stride)
+
+        self.buffer = self.buffer[keep - self.offset:]
+        self.offset = keep
+
+    def finish_year(self):
+        """
+        Sum the remaining windows of the current year, truncated at its last record.
+        """
+        if self.year is None:
+            return
+        seen = len(self.buffer)
+        cumulative = np.concatenate([[0.0], np.cumsum(self.buffer)])
+        # Records are taken as hourly when they are not on a grid.
+        steps = AMS.year_steps([self.year], self.timestep or pd.Timedelta(hours=1))[0]
+        for d, (length, stride, count) in self.specs.items():
+            if self.evaluated[d] < count:
+                starts = np.minimum(
+                    np.arange(self.evaluated[d], count) * stride - self.offset, seen)
+                ends = np.minimum(starts + length, seen)
+                window_sums = cumulative[ends] - cumulative[starts]
+                self.running[d] = max(self.running[d], window_sums.max())
+            self.maxima[d].append(self.running[d])
+            self.completeness[d].append(min(self.valid_slots / steps, 1.0))
+        self.years.append(self.year)
+        self.year = None
+
+    def finish(self):
+        """
+        Close the last year.
+
+        Output:
+            maxima: DataFrame indexed by year with one column of annual maxima per duration.
+            completeness: DataFrame indexed by year with one column of completeness per duration.
+        """
+        self.finish_year()
+        maxima = pd.DataFrame(index=pd.Index(self.years, name='year'))
+        completeness = pd.DataFrame(index=maxima.index)
+        for d in self.durations:
+            maxima[AMS.duration_label(d)] = self.maxima[d]
+            completeness[AMS.duration_label(d)] = self.completeness[d]
+        return maxima, completeness
+
+
+class WindowSums:
+
+    """
+    Cumulative sum of a rainfall time series laid out as one row per year, from which the annual
+    maxima of any duration are computed without going over the series again, and the completeness
+    of each year (see AMS.annual_maxima and AMS.grid_maxima).
+
+    Parameters
+    ----------
+    Input:
+        frame: DataFrame, rainfall time series with a "date" column and a rainfall values column.
+        ams_type: str, either "sliding" for sliding maxima or "fixed" for fixed maxima.
+        on_grid: bool, if True the records are placed on a regular grid of time steps (see
+                AMS.grid_matrix) and durations are windows in time, otherwise durations are
+                numbers of records (see AMS.year_matrix and AMS.window_spec).
+        timestep: timedelta or str, time step of the grid, inferred from the dates if None or "auto".
+        width: int, number of records per year the cumulative sums are first built for, records
+                after them are in no window. They are rebuilt when a longer window is needed.
+    """
+
+    def __init__(self, frame, ams_type, on_grid=False, timestep=None, width=0):
+        if ams_type not in ('sliding', 'fixed'):
+            raise ValueError("ams_type must be either 'sliding' or 'fixed'")
+        self.ams_type = ams_type
+        self.on_grid = on_grid
+
+        with profiling.stage('ams_cumsum'):
+            dates = frame.date.values
+            values = frame[frame.columns.drop('date')[0]].to_numpy(dtype=float)
+            if on_grid:
+                self.timestep = AMS.time_step(dates) if timestep in (
+                    None, 'auto') else pd.Timedelta(timestep)
+                width = AMS.grid_width(self.timestep)
+                self.years, matrix, recorded = AMS.grid_matrix(
+                    dates, values, self.timestep, width)
+                self.year_steps = AMS.year_steps(self.years, self.timestep)
+            else:
+                self.timestep = None
+                # Kept to rebuild the rows when a longer window is needed, see extend.
+                self.dates, self.values = dates, values
+                self.years, matrix, recorded = AMS.year_matrix(dates, values, width)
+                # Records are taken as hourly.
+                self.year_steps = AMS.year_steps(self.years, pd.Timedelta(hours=1))
+
+            # Share of the time steps of the whole year holding a value, the same for every duration.
+            self.year_completeness = np.minimum(recorded / np.maximum(self.year_steps, 1), 1.0)
+            self.accumulate(matrix)
+
+    def accumulate(self, matrix):
+        self.cumulative = np.zeros((matrix.shape[0], matrix.shape[1] + 1))
+        np.cumsum(matrix, axis=1, out=self.cumulative[:, 1:])
+
+    def maxima(self, durations):
+        """
+        Annual maxima and completeness of durations, summing only the windows of these durations.
+
+        Output:
+            maxima: DataFrame indexed by year with one column of annual maxima per duration.
+            completeness: DataFrame indexed by year with one column of completeness per duration.
+        """
+        labels = [AMS.duration_label(d) for d in durations]
+        columns = []
+        for d, label in zip(durations, labels):
+            with profiling.stage('ams_duration', duration=label):
+                columns.append(self.grid_windows(d) if self.on_grid else self.record_windows(d))
+        # Frames are built once from the (year, duration) arrays rather than column by column.
+        index = pd.Index(self.years, name='year')
+        shape = (len(self.years), len(labels))
+        maxima = pd.DataFrame(np.column_stack([m for m, _ in columns]) if columns else np.empty(shape),
+                              index=index, columns=labels)
+        completeness = pd.DataFrame(np.column_stack([c for _, c in columns]) if columns else np.empty(shape),
+                                    index=index, columns=labels)
+        return maxima, completeness
+
+    def extend(self, width):
+        """
+        Rebuild the cumulative sums over the first width records of each year, if they are shorter,
+        so windows up to record width can be summed.
+        """
+        if width + 1 > self.cumulative.shape[1]:
+            with profiling.stage('ams_cumsum'):
+                self.accumulate(AMS.year_matrix(self.dates, self.values, width)[1])
+
+    def record_windows(self, duration):
+        """
+        Annual maximum and completeness of the windows of AMS.window_spec, duration is a number of records.
+        """
+        if not isinstance(duration, (int, np.integer)):
+            raise ValueError("durations must be integers when they are not on a grid of time steps")
+        length, stride, count = AMS.window_spec(self.ams_type, duration)
+        self.extend(length + (count - 1) * stride)
+
+        stop = count * stride
+        window_sums = self.cumulative[:, length:length + stop:stride] - \
+            self.cumulative[:, :stop:stride]
+        return window_sums.max(axis=1), self.year_completeness
+
+    def grid_windows(self, duration):
+        """
+        Annual maximum and completeness of the windows of AMS.grid_maxima, duration is a time span.
+        """
+        width = self.cumulative.shape[1] - 1
+        length = AMS.grid_spec(self.ams_type, duration, self.timestep, width)[0]
+
+        if self.ams_type == 'sliding':
+            # Windows truncated at the end of the year sum less than the last whole window.
+            window_sums = self.cumulative[:, length:] - self.cumulative[:, :width + 1 - length]
+        else:
+            starts = np.arange(0, width, length)
+            ends = np.minimum(starts + length, width)
+            window_sums = self.cumulative[:, ends] - self.cumulative[:, starts]
+        return window_sums.max(axis=1), self.year_completeness
+
+
 class IDF:
 
     """
     This class contains methods to generate IDF curves
     with confidence intervals using scipy genextreme
-    library and custom bootstraping function using numpy.random.choice
+    library and a bootstrap that draws all resamples at once with numpy.random.Generator
+    and fits them across a pool of processes.
+
+    The GEV parameters are estimated with method: "mle" (maximum likelihood, default),
+    "lmoments" or "pwm" (closed form estimators, much faster for the bootstrap).
+
+    Confidence intervals are computed with ci_method: "bootstrap" (default), or "delta" for the
+    normal approximation of the return levels of a single maximum likelihood fit per duration,
+    with their standard errors from the covariance of the fit (see gev_covariance and
+    return_levels). The delta method needs method "mle" and costs no more than the fits without
+    ci, for screening large networks, but its intervals are symmetric and less accurate for
+    short records and long return periods. The middle rows of the table are the median of the
+    bootstrap, or the maximum likelihood return levels with the delta method.
+
+    Years with missing AMS values are left out of the fit of that duration. Given the completeness
+    of each year (see AMS.calculate_AMS, a DataFrame or the path of a .csv file), the years of a
+    duration below min_completeness are left out as well (see reject_incomplete). Durations left
+    with fewer than min_years years are not fitted, whatever the method: a warning is issued, they
+    are listed in self.unfitted and their parameters and IDF column are NaN.
+
+    If fit_cache is given, the fits of each duration are saved to that directory (see fitcache),
+    keyed by its AMS values, method, number_bootstrap and seed, and taken from there the next time
+    the same AMS is fitted with the same options. Changing alpha then only recomputes the return
+    levels and their percentiles. Bootstrap fits are only cached if seed is given. The cache is
+    kept below fit_cache_size bytes by removing the least recently used fits.
+
+    The IDF table has one row per return period in years (and its confidence bounds if ci), see
+    set_return_periods, and one column per duration of the AMS.
     """
-    # Hard coded durations here but can be specified by the user.
 
-    def __init__(self, path, ci, number_bootstrap, alpha):
+    def __init__(self, path, ci, number_bootstrap, alpha, n_jobs=1, seed=None, method='mle',
+                 completeness=None, min_completeness=None, fit_cache=None, fit_cache_size=fitcache.MAX_BYTES,
+                 return_periods=(2, 5, 10, 25, 50, 100, 200), ci_method='bootstrap', min_years=MIN_YEARS):
+        if ci_method not in ('bootstrap', 'delta'):
+            raise ValueError("ci_method must be either 'bootstrap' or 'delta'")
+        if ci and ci_method == 'delta' and method != 'mle':
+            raise ValueError("ci_method 'delta' needs method 'mle'")
         self.ci = ci
+        self.ci_method = ci_method
+        # Whether the confidence intervals come from bootstrap fits rather than from the single fits.
+        self.bootstrapped = bool(ci) and ci_method == 'bootstrap'
+        self.method = method
         self.alpha = alpha
         self.number_bootstrap = number_bootstrap
-        self.quantiles = [1 / 2, 1 / 5, 1 / 10,
-                          1 / 25, 1 / 50, 1 / 100, 1 / 200]
-        self.no_ci_columns = ['2-yr', '5-yr', '10-yr',
-                              '25-yr', '50-yr', '100-yr', '200-yr']
+        self.n_jobs = n_jobs
+        self.seed = seed
+        self.fit_cache = fit_cache
+        self.fit_cache_size = fit_cache_size
+        self.min_years = min_years
+        self.unfitted = []
+
+        self.path = path
+        self.completeness = completeness
+        self.min_completeness = min_completeness
+        self.reformatted_ams()
+        self.params = {}
+        self.bootstrap_params = {}
+        self.covariance = None
+        self.set_return_periods(return_periods)
+
+    def set_return_periods(self, return_periods):
+        """
+        Set the return periods of the IDF table.
+
+        If the GEV distributions are already fitted, the table is evaluated again for the new
+        return periods from the fitted parameters, without fitting again.
+
+        Parameters
+        ----------
+        Input:
+            return_periods: list of float, return periods (average recurrence intervals) in years,
+                    sorted in the table.
+        """
+        self.return_periods = sorted(set(return_periods))
+        self.quantiles = [1 / T for T in self.return_periods]
+        self.no_ci_columns = ["{:g}-yr".format(T) for T in self.return_periods]
 
         wci = []
 
@@ -158,13 +1127,12 @@ class IDF:
                 wci.append("{}{}".format(bound, e))
         self.ci_columns = wci
 
-        self.path = path
-        self.reformatted_ams()
-
         if self.ci:
             self.idf = pd.DataFrame(index=self.ci_columns)
         else:
             self.idf = pd.DataFrame(index=self.no_ci_columns)
+        if self.bootstrap_params if self.bootstrapped else self.params:
+            self.evaluate_IDF()
 
     def reformatted_ams(self):
 
@@ -172,78 +1140,220 @@ class IDF:
             ams = pd.read_csv(self.path, index_col=0)
             self.reformatted_ams = ams.drop(['year'], axis=1)
         elif type(self.path) == type(pd.DataFrame()):
+            ams = self.path
             self.reformatted_ams = self.path.drop(['year'], axis=1)
 
-    def construct_IDF(self):
+        if self.completeness is not None and self.min_completeness is not None:
+            completeness = self.completeness
+            if type(completeness) == str:
+                completeness = pd.read_csv(completeness, index_col=0)
+            self.reformatted_ams = reject_incomplete(
+                ams, completeness, self.min_completeness).drop(['year'], axis=1)
 
-        if self.ci:
-            bts = {}
-            for col in self.reformatted_ams.columns:
-                mams = []
-                for i in range(self.number_bootstrap):
-                    bootsams = np.random.choice(
-                        self.reformatted_ams[col].values, replace=True, size=len(self.reformatted_ams))
-                    fit = gev.fit(bootsams)
-                    mams.append(
-                        gev.isf(self.quantiles, c=fit[0], loc=fit[1], scale=fit[2]))
-                bts[col] = np.asarray(mams)
+    def construct_IDF(self, columns=None, start=None):
+        """
+        Fit a GEV distribution to each duration's AMS and fill the IDF table.
+
+        Parameters
+        ----------
+        Input:
+            columns: list of str, durations to fit, all by default. The fits of the other durations
+                    are taken from params, or bootstrap_params if bootstrapped, e.g. restored from a
+                    previous run.
+            start: dict, starting parameters of the maximum likelihood optimizer per duration, a (3,)
+                    array, or a (number_bootstrap, 3) array if bootstrapped. See fit_gev_rows.
+        """
+        if columns is None:
+            columns = list(self.reformatted_ams.columns)
+        start = start or {}
+
+        years = self.reformatted_ams[columns].notna().sum()
+        short = [col for col in columns if years[col] < self.min_years]
+        if short:
+            warnings.warn("Durations {} have fewer than {} years of AMS and are not fitted".format(
+                ', '.join(short), self.min_years))
+            shape = (self.number_bootstrap, 3) if self.bootstrapped else (3,)
+            fits = self.bootstrap_params if self.bootstrapped else self.params
+            fits.update({col: np.full(shape, np.nan) for col in short})
+            self.unfitted = sorted(set(self.unfitted) | set(short), key=list(self.reformatted_ams.columns).index)
+            columns = [col for col in columns if col not in short]
+        self.unfitted = [col for col in self.unfitted if col not in columns]
+
+        if self.fit_cache is not None:
+            with profiling.stage('fit_cache'):
+                columns = self.load_cached_fits(columns)
+
+        if self.bootstrapped:
+            with profiling.stage('bootstrap', durations=len(columns), method=self.method,
+                                 number_bootstrap=self.number_bootstrap, n_jobs=self.n_jobs):
+                self.bootstrap_params.update(self.bootstrap(columns, start))
+        else:
+            for col in columns:
+                with profiling.stage('fit', duration=col, method=self.method):
+                    col_start = start.get(col)
+                    if col_start is not None:
+                        col_start = np.reshape(col_start, (1, 3))
+                    values = self.reformatted_ams[col].values
+                    self.params[col] = fit_gev_rows(
+                        values[~np.isnan(values)][np.newaxis], self.method, col_start)[0]
+
+        if self.fit_cache is not None and not (self.bootstrapped and self.seed is None):
+            fits = self.bootstrap_params if self.bootstrapped else self.params
+            for col in columns:
+                fitcache.save_fit(self.fit_cache, self.cache_key(col), fits[col], self.fit_cache_size)
+
+        with profiling.stage('evaluate'):
+            self.evaluate_IDF()
+
+    def cache_key(self, col):
+        """
+        Key of the fits of one duration in fit_cache.
+        """
+        values = self.reformatted_ams[col].values
+        if self.bootstrapped:
+            return fitcache.fit_key(values, self.method, self.number_bootstrap, self.seed)
+        return fitcache.fit_key(values, self.method)
+
+    def load_cached_fits(self, columns):
+        """
+        Take the fits of columns from fit_cache, returning the columns that still have to be fitted.
+        """
+        if self.bootstrapped and self.seed is None:
+            return columns
+        fits = self.bootstrap_params if self.bootstrapped else self.params
+        missing = []
+        for col in columns:
+            params = fitcache.load_fit(self.fit_cache, self.cache_key(col))
+            if params is None:
+                missing.append(col)
+            else:
+                fits[col] = params
+        return missing
+
+    def evaluate_IDF(self):
+        """
+        Fill the IDF table from the fitted GEV parameters, without fitting again.
+
+        The return levels of all durations and return periods are evaluated at once, see return_levels.
+        """
+        columns = list(self.reformatted_ams.columns)
+        if self.bootstrapped:
+            params = np.stack([self.bootstrap_params[col] for col in columns], axis=1)
+            bts = return_levels(params, self.quantiles)
 
             p_lo = ((1.0-self.alpha)/2.0) * 100
             p_up = (self.alpha+((1.0-self.alpha)/2.0)) * 100
-            for col in self.reformatted_ams.columns:
-                lower = np.apply_along_axis(np.percentile, 0, bts[col], p_lo)
-                upper = np.apply_along_axis(np.percentile, 0, bts[col], p_up)
-                median = np.apply_along_axis(
-                    np.percentile, 0, bts[col], 50)
-                self.idf[col] = np.append(lower, np.append(median, upper))
+            # Resamples without a valid fit (NaN, see fit_gev_rows) are left out, and
+            # durations that were not fitted stay NaN.
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning)
+                bounds = np.nanpercentile(bts, [p_lo, 50, p_up], axis=0)
         else:
+            params = np.stack([self.params[col] for col in columns])
+            if self.ci:
+                self.covariance = gev_covariance(self.reformatted_ams[columns].values.T, params)
+                levels, se = return_levels(params, self.quantiles, self.covariance)
+                z = norm.ppf((1.0 + self.alpha) / 2.0)
+                bounds = np.stack([levels - z * se, levels, levels + z * se])
+            else:
+                bounds = return_levels(params, self.quantiles)[np.newaxis]
 
-            for col in self.reformatted_ams.columns:
-                fit = gev.fit(self.reformatted_ams[col])
-                self.idf[col] = gev.isf(self.quantiles, c=fit[0],
-                                        loc=fit[1], scale=fit[2])
+        for i, col in enumerate(columns):
+            self.idf[col] = bounds[:, i, :].ravel()
 
-    def plot_IDF(self, savepath, figformat):
+    def bootstrap(self, columns, start=None):
+        """
+        Fit a GEV distribution to bootstrap resamples of each duration's AMS.
 
-        # Hard coded params
-        rcParams['xtick.labelsize'] = 14
-        rcParams['ytick.labelsize'] = 14
+        A single (number_bootstrap, years) matrix of resample indices is drawn from seed and used for
+        every duration, so the curves of one replicate are coherent across durations, and results do
+        not depend on n_jobs or on the durations fitted together. A resample is a multiset of years,
+        so the indices of each resample are sorted and identical resamples are fitted only once.
+        With method "mle" the unique resamples are split in chunks fitted across n_jobs processes,
+        which read the index matrix and the AMS from shared memory instead of receiving copies.
+        Years rejected for completeness (NaN in the AMS) are left out of the resamples, durations
+        with the same years share their resamples.
 
-        if self.ci:
-            idf_transposed = self.idf.transpose()
-            dfmean = idf_transposed.drop([x for x in idf_transposed.columns if (
-                x[:1] == 'L' or x[:1] == 'U')], axis=1)
-
-            fig, axs = plt.subplots(figsize=(13, 10))
-            a1 = dfmean.plot(ax=axs)
-            fill_alpha = 0.3
-
-        # Hard coded this durations and return periods, could change to user input
-
-            plt.xticks(np.arange(0, 8), ('1H', '2H', '3H',
-                                         '6H', '12H', '24H', '48H', '72H'))
-            # Hard coded to display only up to ARI 10 because others overlap
-            plt.fill_between(np.arange(0, 8), idf_transposed['L2-yr'].values,
-                             idf_transposed['U2-yr'].values, alpha=fill_alpha)
-            plt.fill_between(np.arange(0, 8), idf_transposed['L5-yr'].values,
-                             idf_transposed['U5-yr'].values, alpha=fill_alpha)
-            plt.fill_between(np.arange(0, 8), idf_transposed['L10-yr'].values,
-                             idf_transposed['U10-yr'].values, alpha=fill_alpha)
-            legend = plt.legend(bbox_to_anchor=(1, 0.75),
-                                title='Duration', fontsize=13)
-            plt.setp(legend.get_title(), fontsize=15)
-            plt.ylabel('Precipitation Depth (in)', {'fontsize': 18})
-            plt.xlabel('Duration', {'fontsize': 18})
-            plt.grid()
+        Parameters
+        ----------
+        Input:
+            columns: list of str, durations to fit.
+            start: dict, (number_bootstrap, 3) starting parameters per duration, see fit_gev_rows.
+        Output:
+            dict, (number_bootstrap, 3) array of GEV (shape, location, scale) parameters per duration.
+        """
+        start = start or {}
+        ams = np.ascontiguousarray(
+            self.reformatted_ams[columns].values, dtype=float)
+        valid = ~np.isnan(ams)
 
-        else:
-            self.idf.plot(figsize=(9, 7))
-            legend = plt.legend(bbox_to_anchor=(1, 0.75),
-                                title='Duration', fontsize=11)
-            plt.setp(legend.get_title(), fontsize=15)
-            plt.ylabel('Precipitation Depth (in)', {'fontsize': 18})
-            plt.xlabel('Average Recurrence Interval', {'fontsize': 18})
-            plt.grid()
-
-        plt.savefig("{}/Figure.{}".format(savepath,
-                                          figformat), bbox_inches='tight')
+        fits = {}
+        for mask in np.unique(valid.T, axis=0):
+            group = [j for j in range(len(columns)) if np.array_equal(valid[:, j], mask)]
+            group_columns = [columns[j] for j in group]
+            years = np.flatnonzero(mask).astype(np.int32)
+
+            rng = np.random.default_rng(self.seed)
+            index = years[np.sort(rng.integers(0, len(years), size=(
+                self.number_bootstrap, len(years)), dtype=np.int32), axis=1)]
+            unique, first, inverse = np.unique(
+                index, axis=0, return_index=True, return_inverse=True)
+            inverse = inverse.ravel()
+            starts = {col: np.asarray(start[col])[first]
+                      for col in group_columns if start.get(col) is not None}
+
+            if self.method == 'mle' and self.n_jobs > 1:
+                group_fits = self.bootstrap_shared(
+                    unique, np.ascontiguousarray(ams[:, group]), group_columns, starts)
+            else:
+                group_fits = {}
+                for j, col in zip(group, group_columns):
+                    with profiling.stage('bootstrap_fit', duration=col, method=self.method):
+                        group_fits[col] = fit_gev_rows(
+                            ams[unique, j], self.method, starts.get(col))
+            fits.update({col: group_fits[col][inverse] for col in group_columns})
+
+        return fits
+
+    def bootstrap_shared(self, index, ams, columns, start):
+        """
+        Fit the resamples of every duration across n_jobs processes, sharing index and ams.
+
+        Parameters
+        ----------
+        Input:
+            index: numpy array, (number of resamples, years) resample indices.
+            ams: numpy array, (years, len(columns)) AMS of the durations to fit.
+            columns: list of str, durations to fit.
+            start: dict, (number of resamples, 3) starting parameters per duration.
+        Output:
+            dict, (number of resamples, 3) array of GEV (shape, location, scale) parameters per duration.
+        """
+        index_shm, index_spec = share_array(index)
+        ams_shm, ams_spec = share_array(ams)
+        try:
+            bounds = np.linspace(0, len(index), self.n_jobs + 1).astype(int)
+            with ProcessPoolExecutor(max_workers=self.n_jobs) as pool:
+                futures = {col: [pool.submit(fit_shared_rows, index_spec, ams_spec, j, slice(lo, hi), self.method,
+                                             None if col not in start else start[col][lo:hi])
+                                 for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+                           for j, col in enumerate(columns)}
+                return {col: np.concatenate([f.result() for f in col_futures])
+                        for col, col_futures in futures.items()}
+        finally:
+            for shm in (index_shm, ams_shm):
+                shm.close()
+                shm.unlink()
+
+    @profiling.profiled('plot')
+    def plot_IDF(self, savepath, figformat):
+        """
+        Draw the IDF curves and save them to savepath/Figure.figformat, see plotting.
+
+        Output:
+            Figure, reused by the next plot made in this process.
+        """
+        path = "{}/Figure.{}".format(savepath, figformat)
+        fig = plotting.plotter().draw(self.idf, self.ci)
+        fig.savefig(path, bbox_inches='tight')
+        return fig
@@ -0,0 +1,336 @@
+"""
+File name: deltachange
+
+##############################
+
+Purpose:
+
+Construct future station IDF curves from an ensemble of downscaled GCM
+runs with the delta-change method, as in the
+Use_Downscaled_GCM_Output_Future_Station_IDF_Curves notebook but for
+every model, scenario and duration at once.
+
+Each GCM file holds the daily rainfall of many models (one column per
+model) and is read once. The AMS of every model and duration is
+extracted in one pass, the GEV fits of all models are spread across
+a pool of processes, and the change factors (future / historical return
+levels) and future station IDF values are computed on
+(model x duration x return period) arrays.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from constructIDF import IDF
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import re
+
+SCENARIO_PATTERN = re.compile(r'[_\-\s]*(historical|rcp\d+|ssp\d+|\(.*?\))', re.IGNORECASE)
+
+
+def read_gcm(path, skiprows=26, date_column='yyyy-mm-dd'):
+    """
+    Read a downscaled GCM file, e.g. MACA output.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the .csv file.
+        skiprows: int, number of header lines before the column names.
+        date_column: str, name of the date column.
+    Output:
+        DataFrame, daily rainfall indexed by date, one column per model.
+    """
+    frame = pd.read_csv(path, skiprows=skiprows,
+                        parse_dates=[date_column], index_col=date_column)
+    return frame.apply(pd.to_numeric, errors='coerce')
+
+
+def duration_label(days):
+    """
+    Column name of a duration in days, matching the station IDF tables, e.g. "24H".
+    """
+    return "{}H".format(24 * days)
+
+
+def gcm_ams(frame, durations=(1,), period=None):
+    """
+    Annual maxima of the d-day rainfall of every model, for each duration d.
+
+    Windows never span two years and windows with missing days are ignored, as the
+    sliding maxima of AMS. All models and durations are grouped by year in one pass.
+
+    Parameters
+    ----------
+    Input:
+        frame: DataFrame, daily rainfall indexed by date, one column per model, see read_gcm.
+        durations: list of int, durations in days.
+        period: tuple of int, first and last year to keep, all years if None.
+    Output:
+        DataFrame, AMS indexed by year, with (duration, model) columns.
+    """
+    values = frame.values.astype(float)
+    years = frame.index.year.values
+    missing = np.isnan(values)
+
+    n = len(values)
+    total = np.zeros((n + 1, values.shape[1]))
+    np.cumsum(np.where(missing, 0.0, values), axis=0, out=total[1:])
+    gaps = np.zeros((n + 1, values.shape[1]), dtype=np.int64)
+    np.cumsum(missing, axis=0, out=gaps[1:])
+
+    windows = np.full((n, len(durations) * values.shape[1]), np.nan)
+    for i, d in enumerate(durations):
+        if d > n:
+            continue
+        # Window j covers the records j to j + d - 1 and is assigned to the year of record j.
+        sums = total[d:] - total[:-d]
+        invalid = (gaps[d:] - gaps[:-d] > 0) | (years[:n - d + 1] != years[d - 1:])[:, np.newaxis]
+        sums[invalid] = np.nan
+        windows[:n - d + 1, i * values.shape[1]:(i + 1) * values.shape[1]] = sums
+
+    columns = pd.MultiIndex.from_product([[duration_label(d) for d in durations], frame.columns],
+                                         names=['duration', 'model'])
+    ams = pd.DataFrame(windows, columns=columns).groupby(years).max()
+    ams.index.name = 'year'
+    if period is not None:
+        ams = ams.loc[period[0]:period[1]]
+    return ams
+
+
+def fit_series(ams, ci=False, number_bootstrap=100, alpha=0.9, seed=None, method='mle',
+               return_periods=(2, 5, 10, 25, 50, 100, 200), ci_method='bootstrap'):
+    """
+    Return levels of each column of an AMS array, see IDF.
+
+    Parameters
+    ----------
+    Input:
+        ams: numpy array, (years, series) AMS.
+        ci, number_bootstrap, alpha, seed, method, return_periods, ci_method: see IDF.
+    Output:
+        levels: numpy array, (series, rows) return levels, with the rows of the IDF table.
+        rows: list of str, return periods (and bounds if ci) of the rows.
+    """
+    frame = pd.DataFrame(ams, columns=[str(i) for i in range(ams.shape[1])])
+    frame.insert(0, 'year', 0)
+    data = IDF(frame, ci, number_bootstrap, alpha, seed=seed, method=method,
+               return_periods=return_periods, ci_method=ci_method)
+    data.construct_IDF()
+    return data.idf.values.T, list(data.idf.index)
+
+
+def return_levels(ams, n_jobs=1, **options):
+    """
+    Fit the AMS of every model and duration, spreading the models across n_jobs processes.
+
+    Parameters
+    ----------
+    Input:
+        ams: DataFrame, AMS with (duration, model) columns, see gcm_ams.
+        n_jobs: int, number of processes.
+        options: keyword arguments passed to fit_series.
+    Output:
+        levels: numpy array, (model, duration, rows) return levels.
+        rows: list of str, return periods (and bounds if ci) of the rows.
+    """
+    values = ams.values
+    chunks = [c for c in np.array_split(np.arange(values.shape[1]), max(n_jobs, 1)) if len(c)]
+    if n_jobs > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(fit_series, values[:, c], **options) for c in chunks]
+            results = [f.result() for f in futures]
+    else:
+        results = [fit_series(values[:, c], **options) for c in chunks]
+
+    levels = np.concatenate([r[0] for r in results])
+    durations = ams.columns.get_level_values('duration').unique()
+    levels = levels.reshape(len(durations), -1, levels.shape[1]).transpose(1, 0, 2)
+    return levels, results[0][1]
+
+
+def model_name(column):
+    """
+    Name of the model of a GCM column, without its scenario and units, e.g.
+    "bcc-csm1-1_rcp85(mm)" and "bcc-csm1-1_historical(mm)" give "bcc-csm1-1".
+    """
+    return SCENARIO_PATTERN.sub('', str(column)).strip()
+
+
+def match_models(historical, future):
+    """
+    Position of the historical run of each future model.
+
+    Models are matched by name (see model_name) if every future model has a historical run,
+    otherwise by position if both files have the same number of models.
+
+    Parameters
+    ----------
+    Input:
+        historical: list of str, historical model columns.
+        future: list of str, future model columns.
+    Output:
+        numpy array, index in historical of each future model.
+    """
+    names = [model_name(c) for c in historical]
+    if len(set(names)) == len(names) and all(model_name(c) in names for c in future):
+        return np.array([names.index(model_name(c)) for c in future])
+    elif len(historical) == len(future):
+        return np.arange(len(future))
+    raise ValueError("The models of the historical and future files do not match")
+
+
+def station_levels(station_idf, durations, rows, all_durations=False):
+    """
+    Station return levels as a (duration, rows) array aligned with the GCM return levels.
+
+    Parameters
+    ----------
+    Input:
+        station_idf: DataFrame, station IDF table, see IDF.
+        durations: list of str, durations of the GCM return levels, e.g. ["24H"].
+        rows: list of str, rows of the GCM return levels. Rows missing in the station table are NaN.
+        all_durations: bool, if True every duration of the station is returned.
+    Output:
+        numpy array, (duration, rows) return levels.
+    """
+    station = station_idf.reindex(index=rows)
+    if not all_durations:
+        station = station[list(durations)]
+    return station.values.T
+
+
+def tidy(levels, models, durations, rows, scenario):
+    """
+    Table of a (model, duration, rows) array with scenario, model and return_period columns
+    and one column per duration, as the summary of run.py --batch.
+    """
+    table = pd.DataFrame(levels.transpose(0, 2, 1).reshape(-1, len(durations)),
+                         columns=list(durations))
+    table.insert(0, 'return_period', np.tile(rows, len(models)))
+    table.insert(0, 'model', np.repeat([model_name(m) for m in models], len(rows)))
+    table.insert(0, 'scenario', scenario)
+    return table
+
+
+def run_ensemble(historical, future, station_idf=None, durations=(1,), hist_period=None, period=None,
+                 all_durations=False, n_jobs=1, skiprows=26, date_column='yyyy-mm-dd', **options):
+    """
+    Change factors of every GCM run and the future station IDF they give.
+
+    Parameters
+    ----------
+    Input:
+        historical: list of str, historical GCM files, either one shared by every future file
+                or one per future file.
+        future: list of str, future GCM files, e.g. one per scenario and downscaling method.
+                The scenario of a file is its name without extension.
+        station_idf: DataFrame, station IDF table, see IDF. The future station IDF is not computed if None.
+        durations: list of int, durations in days.
+        hist_period, period: tuple of int, first and last year of the historical and future AMS.
+        all_durations: bool, if True the change factor of the single GCM duration is applied to every
+                duration of the station, otherwise only the station durations matching the GCM durations
+                are updated.
+        n_jobs: int, number of processes used for the GEV fits.
+        skiprows, date_column: see read_gcm.
+        options: keyword arguments passed to fit_series (ci, number_bootstrap, alpha, seed, method,
+                return_periods, ci_method).
+    Output:
+        change_factors: DataFrame, change factor per scenario, model, return period and duration.
+        future_idf: DataFrame, future station IDF with the same layout, None if station_idf is None.
+    """
+    if len(historical) not in (1, len(future)):
+        raise ValueError("Give either one historical file or one per future file")
+    if all_durations and len(durations) != 1:
+        raise ValueError("all_durations requires a single GCM duration")
+    labels = [duration_label(d) for d in durations]
+
+    fitted = {}
+    change_factors, future_idf = [], []
+    for hist_path, fut_path in zip(historical * len(future) if len(historical) == 1 else historical, future):
+        if hist_path not in fitted:
+            hist_ams = gcm_ams(read_gcm(hist_path, skiprows, date_column), durations, hist_period)
+            fitted[hist_path] = (hist_ams.columns.get_level_values('model').unique(),
+                                 return_levels(hist_ams, n_jobs, **options)[0])
+        hist_models, hist_levels = fitted[hist_path]
+
+        fut_ams = gcm_ams(read_gcm(fut_path, skiprows, date_column), durations, period)
+        fut_models = fut_ams.columns.get_level_values('model').unique()
+        fut_levels, rows = return_levels(fut_ams, n_jobs, **options)
+
+        factors = fut_levels / hist_levels[match_models(list(hist_models), list(fut_models))]
+        scenario = os.path.splitext(os.path.basename(fut_path))[0]
+        change_factors.append(tidy(factors, fut_models, labels, rows, scenario))
+
+        if station_idf is not None:
+            station = station_levels(station_idf, labels, rows, all_durations)
+            future_idf.append(tidy(factors * station[np.newaxis], fut_models,
+                                   list(station_idf.columns) if all_durations else labels, rows, scenario))
+
+    change_factors = pd.concat(change_factors, ignore_index=True)
+    future_idf = pd.concat(future_idf, ignore_index=True) if future_idf else None
+    return change_factors, future_idf
+
+
+def main(args):
+    station_idf = pd.read_csv(args.station_idf, index_col=0) if args.station_idf else None
+    change_factors, future_idf = run_ensemble(
+        args.historical, args.future, station_idf=station_idf, durations=args.durations,
+        hist_period=args.hist_period, period=args.period, all_durations=args.all_durations,
+        n_jobs=args.n_jobs, skiprows=args.skiprows, date_column=args.date_column,
+        ci=args.ci, number_bootstrap=args.number_bootstrap, alpha=args.alpha,
+        seed=args.seed, method=args.method, return_periods=args.return_periods, ci_method=args.ci_method)
+
+    os.makedirs(args.savepath, exist_ok=True)
+    change_factors.to_csv(os.path.join(args.savepath, 'change_factors.csv'), index=False)
+    if future_idf is not None:
+        future_idf.to_csv(os.path.join(args.savepath, 'future_idf.csv'), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Construct future station IDF curves from downscaled GCM output with the delta-change method")
+
+    parser.add_argument("--historical", required = True, type = str, nargs = '+',
+                        help = "Historical GCM .csv files, either one for every future file or one per future file")
+    parser.add_argument("--future", required = True, type = str, nargs = '+',
+                        help = "Future GCM .csv files, e.g. one per scenario and downscaling method")
+    parser.add_argument("--station_idf", default = None, type = str,
+                        help = "IDF.csv of the station to update. Only the change factors are computed if not given")
+    parser.add_argument("--durations", default = [1], type = int, nargs = '+',
+                        help = "Durations in days, default 1")
+    parser.add_argument("--hist_period", default = None, type = int, nargs = 2,
+                        help = "First and last year of the historical AMS, all years by default")
+    parser.add_argument("--period", default = None, type = int, nargs = 2,
+                        help = "First and last year of the future AMS, e.g. 2043 2099, all years by default")
+    parser.add_argument("--all_durations", action = "store_true",
+                        help = "Apply the change factor of the single GCM duration to every duration of the station")
+    parser.add_argument("--ci", action = "store_true",
+                        help = "Compute confidence intervals")
+    parser.add_argument("--ci_method", default = "bootstrap", type = str, choices = ["bootstrap", "delta"],
+                        help = "Confidence intervals from 'bootstrap' fits, or by the 'delta' method from a single "
+                               "maximum likelihood fit per duration, much faster but approximate. Default bootstrap")
+    parser.add_argument("--number_bootstrap", default = 100, type = int,
+                        help = "Number of bootstrap samples to generate, default 100")
+    parser.add_argument("--alpha", default = 0.9, type = float,
+                        help = "confidence level, e.g. 0.9 or 0.99, default 0.9")
+    parser.add_argument("--seed", default = None, type = int,
+                        help = "Seed of the bootstrap random number generator, for reproducible confidence intervals")
+    parser.add_argument("--method", default = "mle", type = str,
+                        help = "GEV estimator, 'mle', 'lmoments' or 'pwm', default 'mle'")
+    parser.add_argument("--return_periods", default = [2, 5, 10, 25, 50, 100, 200], type = float, nargs = '+',
+                        help = "Return periods in years, default 2 5 10 25 50 100 200")
+    parser.add_argument("--n_jobs", default = 1, type = int,
+                        help = "Number of processes used to fit the models, default 1")
+    parser.add_argument("--skiprows", default = 26, type = int,
+                        help = "Number of header lines of the GCM files, default 26")
+    parser.add_argument("--date_column", default = "yyyy-mm-dd", type = str,
+                        help = "Name of the date column of the GCM files, default yyyy-mm-dd")
+    parser.add_argument("--savepath", required = True, type = str,
+                        help = "Directory where change_factors.csv and future_idf.csv are saved")
+
+    args = parser.parse_args()
+
+    main(args)
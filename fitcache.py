@@ -0,0 +1,95 @@
+"""
+File name: fitcache
+
+##############################
+
+Purpose:
+
+Keep the GEV fits of each AMS on disk so that running IDF again on the
+same AMS, e.g. with a different alpha, only recomputes the return levels
+and their percentiles from the saved fits.
+
+An entry is one .npy file holding the fitted GEV parameters of one
+duration's AMS, or the (number_bootstrap, 3) parameters of its bootstrap
+resamples. Its name is a hash of the AMS values and of the options that
+change the fits (estimator, number of bootstrap samples and seed), so the
+same AMS always maps to the same entry. Entries are touched when read, and
+the least recently used ones are removed once the cache grows beyond
+max_bytes.
+
+"""
+
+import cache
+import numpy as np
+import hashlib
+import json
+import os
+
+MAX_BYTES = 256 * 2**20
+
+
+def fit_key(values, method, number_bootstrap=None, seed=None):
+    """
+    Name of the cache entry of the fits of one AMS.
+
+    Parameters
+    ----------
+    Input:
+        values: numpy array, AMS of one duration, NaN for the years left out.
+        method: str, GEV estimator, see IDF.
+        number_bootstrap: int, number of bootstrap samples, None for a single fit.
+        seed: int, seed of the bootstrap resamples.
+    Output:
+        str, hexadecimal key.
+    """
+    digest = hashlib.sha1(np.ascontiguousarray(values, dtype=float).tobytes())
+    digest.update(json.dumps([method, number_bootstrap, seed]).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_fit(cache_dir, key):
+    """
+    Fits saved under key, None if there are none.
+    """
+    path = os.path.join(cache_dir, key + '.npy')
+    try:
+        params = np.load(path)
+        # The modification time orders entries for eviction.
+        os.utime(path)
+    except (OSError, ValueError):
+        return None
+    return params
+
+
+def save_fit(cache_dir, key, params, max_bytes=MAX_BYTES):
+    """
+    Save fits under key, then evict the least recently used entries beyond max_bytes.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.npy')
+    cache.write_atomic(path, lambda tmp: np.save(tmp, np.asarray(params, dtype=float)), '.npy')
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir, max_bytes=MAX_BYTES):
+    """
+    Remove the least recently used entries until the cache holds at most max_bytes.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy') and '.tmp' not in name:
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except OSError:
+            pass
+        total -= size
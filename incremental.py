@@ -0,0 +1,206 @@
+"""
+File name: incremental
+
+##############################
+
+Purpose:
+
+Update the AMS and IDF of a station when new records are appended
+to its time series, instead of computing them from scratch.
+
+Next to AMS.csv, completeness.csv and IDF.csv, the state of the last run is saved to
+state.json (a digest of the records of each year, a digest of each
+duration's AMS and its GEV fit) and bootstrap.npz (the bootstrap fits).
+On the next run only the years whose records changed are processed again
+and only the durations whose AMS changed are fitted again, starting the
+optimizer from the previous fit.
+
+"""
+
+from constructIDF import AMS, IDF, reject_incomplete
+import fitcache
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+
+
+def year_digests(frame):
+    """
+    Digest of the dates and rainfall values of each year of a time series.
+
+    Parameters
+    ----------
+    Input:
+        frame: DataFrame, rainfall time series with a "date" column and a rainfall values column.
+    Output:
+        dict, hexadecimal digest per year.
+    """
+    dates = frame.date.values.astype('datetime64[ns]')
+    values = frame.drop(['date'], axis=1).iloc[:, 0].values.astype(float)
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    order = np.argsort(years, kind='stable')
+    years, dates, values = years[order], dates[order], values[order]
+
+    bounds = np.flatnonzero(np.diff(years)) + 1
+    digests = {}
+    for year, d, v in zip(years[np.r_[0, bounds]], np.split(dates, bounds), np.split(values, bounds)):
+        digest = hashlib.sha1(d.tobytes())
+        digest.update(v.tobytes())
+        digests[str(year)] = digest.hexdigest()
+    return digests
+
+
+def ams_digest(values):
+    """
+    Digest of the AMS of one duration.
+    """
+    return hashlib.sha1(np.asarray(values, dtype=float).tobytes()).hexdigest()
+
+
+def load_state(savepath):
+    """
+    State saved by the last run in savepath, None if there is none.
+    """
+    try:
+        with open(os.path.join(savepath, 'state.json')) as f:
+            state = json.load(f)
+        ams = pd.read_csv(os.path.join(savepath, 'AMS.csv'),
+                          index_col=0, float_precision='round_trip')
+        completeness = pd.read_csv(os.path.join(savepath, 'completeness.csv'),
+                                   index_col=0, float_precision='round_trip')
+    except (OSError, ValueError):
+        return None
+
+    state['ams'] = ams
+    state['completeness'] = completeness
+    bootstrap_path = os.path.join(savepath, 'bootstrap.npz')
+    if os.path.exists(bootstrap_path):
+        with np.load(bootstrap_path) as bootstrap:
+            state['bootstrap'] = {col: bootstrap[col] for col in bootstrap.files}
+    else:
+        state['bootstrap'] = {}
+    return state
+
+
+def save_state(savepath, state, data):
+    """
+    Save the state of this run, see load_state.
+    """
+    state = dict(state)
+    state['fits'] = {col: {'ams': ams_digest(data.reformatted_ams[col].values),
+                           'params': data.params[col].tolist() if col in data.params else None}
+                     for col in data.reformatted_ams.columns}
+    with open(os.path.join(savepath, 'state.json'), 'w') as f:
+        json.dump(state, f, indent=1)
+    if data.bootstrap_params:
+        np.savez(os.path.join(savepath, 'bootstrap.npz'),
+                 **data.bootstrap_params)
+
+
+def update_station(path, savepath, durations, ftype, ci=False, number_bootstrap=100, alpha=0.9,
+                   n_jobs=1, seed=None, method='mle', cache_dir=None, timestep='auto', min_completeness=None,
+                   fit_cache=None, fit_cache_size=fitcache.MAX_BYTES, return_periods=(2, 5, 10, 25, 50, 100, 200),
+                   ci_method='bootstrap'):
+    """
+    Compute the AMS and IDF of a station, reusing the results of the last run saved in savepath.
+
+    Changing durations, ftype, timestep or min_completeness recomputes the AMS of every year. Changing ci, ci_method,
+    number_bootstrap, method or seed fits every duration again, starting from the previous fits. Changing alpha
+    or return_periods only recomputes the IDF table from the saved fits.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the station time series .csv file.
+        savepath: str, directory where AMS.csv, IDF.csv and the state of the run are saved.
+        durations, ftype, cache_dir, timestep, min_completeness: see AMS and AMS.calculate_AMS.
+        ci, number_bootstrap, alpha, n_jobs, seed, method, fit_cache, fit_cache_size, return_periods,
+        ci_method: see IDF.
+    Output:
+        out: DataFrame, AMS of the station.
+        data: IDF, fitted IDF of the station.
+        updated: dict, "years" whose AMS were computed and "durations" that were fitted in this run.
+    """
+    previous = load_state(savepath)
+    stat = os.stat(path)
+    state = {'source': {'path': os.path.abspath(path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size},
+             'ams_options': {'durations': [d if isinstance(d, int) else AMS.duration_label(d) for d in durations],
+                             'ftype': ftype, 'timestep': None if timestep is None else str(timestep),
+                             'min_completeness': min_completeness},
+             'fit_options': {'ci': bool(ci), 'ci_method': ci_method, 'number_bootstrap': number_bootstrap,
+                             'method': method, 'seed': seed}}
+
+    same_ams = previous is not None and previous['ams_options'] == state['ams_options']
+    same_fits = same_ams and previous['fit_options'] == state['fit_options']
+
+    if same_ams and previous['source'] == state['source']:
+        # The file did not change, the saved AMS is up to date.
+        state['digests'] = previous['digests']
+        out = previous['ams']
+        completeness = previous['completeness']
+        changed_years = []
+    else:
+        ts = AMS(path, durations, cache_dir=cache_dir, timestep=timestep)
+        frame = ts.reformatted_frame
+        if AMS.on_grid(durations, timestep) and timestep in (None, 'auto'):
+            # Infer the time step from the whole record, not only from the years that changed.
+            timestep = AMS.time_step(frame.date.values)
+        state['digests'] = year_digests(frame)
+        old_digests = previous['digests'] if same_ams else {}
+        changed_years = sorted(int(year) for year, digest in state['digests'].items()
+                               if old_digests.get(year) != digest)
+
+        frame_years = frame.date.dt.year
+        maxima, year_completeness = AMS.annual_maxima(
+            frame[frame_years.isin(changed_years)], durations, ftype, timestep)
+        if same_ams:
+            kept_years = [int(year) for year in state['digests'] if int(year) not in changed_years]
+            maxima = pd.concat([previous['ams'].set_index('year').reindex(kept_years), maxima])
+            year_completeness = pd.concat(
+                [previous['completeness'].set_index('year').reindex(kept_years), year_completeness])
+        # Keep the order of the years in the time series, as AMS.calculate_AMS.
+        out = pd.DataFrame(frame_years.unique(), columns=['year'])
+        completeness = out.copy()
+        for label in map(AMS.duration_label, durations):
+            out[label] = maxima[label].reindex(out.year).values
+            completeness[label] = year_completeness[label].reindex(out.year).values
+        if min_completeness is not None:
+            out = reject_incomplete(out, completeness, min_completeness)
+
+    out.to_csv(os.path.join(savepath, 'AMS.csv'))
+    completeness.to_csv(os.path.join(savepath, 'completeness.csv'))
+
+    data = IDF(out, ci, number_bootstrap, alpha, n_jobs=n_jobs, seed=seed, method=method,
+               fit_cache=fit_cache, fit_cache_size=fit_cache_size, return_periods=return_periods,
+               ci_method=ci_method)
+    old_fits = previous['fits'] if previous is not None else {}
+    refit, start = [], {}
+    for col in data.reformatted_ams.columns:
+        fit = old_fits.get(col)
+        unchanged = same_fits and fit is not None and fit['ams'] == ams_digest(
+            data.reformatted_ams[col].values)
+        if data.bootstrapped:
+            saved = previous['bootstrap'].get(col) if previous is not None else None
+            if saved is not None and saved.shape != (number_bootstrap, 3):
+                saved = None
+            if unchanged and saved is not None:
+                data.bootstrap_params[col] = saved
+                continue
+            if saved is not None:
+                start[col] = saved
+        else:
+            saved = fit['params'] if fit is not None else None
+            if unchanged and saved is not None:
+                data.params[col] = np.asarray(saved)
+                continue
+            if saved is not None:
+                start[col] = np.asarray(saved)
+        refit.append(col)
+
+    data.construct_IDF(columns=refit, start=start)
+    data.idf.to_csv(os.path.join(savepath, 'IDF.csv'))
+    save_state(savepath, state, data)
+
+    return out, data, {'years': changed_years, 'durations': refit}
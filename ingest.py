@@ -0,0 +1,247 @@
+"""
+File name: ingest
+
+##############################
+
+Purpose:
+
+Convert raw NCEI hourly precipitation station files into the time series
+format read by AMS, replacing the Reformat_NCEI_data notebook.
+
+Two layouts are read:
+
+- The COOP Hourly Precipitation Data v2 layout
+  (https://www.ncei.noaa.gov/data/coop-hourly-precipitation/v2/), one row
+  per day with the station metadata, the daily sum and 24 hourly values
+  HR00Val ... HR23Val, each with its flags, in hundredths of inches with
+  -9999 for missing hours. HRxxVal is the rainfall of the hour starting at
+  xx:00.
+- The Climate Data Online layout, one row per record with the STATION,
+  NAME, DATE and HPCP columns, in inches with 999.99 for missing records.
+  These files usually list only the hours with rain, so the records are
+  kept as they are and the hours not listed are absent from the output.
+
+The output is a csv file per station with the date, the rainfall in inches
+(val, missing records left empty) and the quality and measurement flags, in
+the same format as the Reformat_NCEI_data notebook. The wide layout is
+reshaped with numpy into one record per hour without looping over days.
+Files are converted in parallel across processes, and if a cache directory
+is given the parsed series are written straight into it (see cache), so
+later AMS runs never parse the csv files.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from batch import find_stations, station_name
+import cache
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import traceback
+
+MISSING_WIDE = -9999
+MISSING_LONG = 999.99
+METADATA = ('STATION', 'NAME', 'LATITUDE', 'LONGITUDE', 'ELEVATION')
+
+
+def read_hourly(path, period=None):
+    """
+    Read a raw NCEI hourly precipitation file, in either layout.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the NCEI .csv file.
+        period: tuple of int, first and last year to keep, all years by default.
+    Output:
+        series: DataFrame, with date, val, qflags and mflags columns, sorted by date.
+        metadata: dict, station id, name, latitude, longitude and elevation found in the file.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    if 'HR00Val' in header:
+        return read_wide(path, header, period)
+    elif 'HPCP' in header:
+        return read_long(path, header, period)
+    raise ValueError("{} has neither HR00Val ... HR23Val nor HPCP columns".format(path))
+
+
+def read_wide(path, header, period=None):
+    """
+    Read a file in the COOP Hourly Precipitation Data v2 layout, see read_hourly.
+    """
+    hours = ['HR{:02d}'.format(h) for h in range(24)]
+    values = [h + 'Val' for h in hours]
+    mflags = [h + 'MF' for h in hours if h + 'MF' in header]
+    qflags = [h + 'QF' for h in hours if h + 'QF' in header]
+    metadata = [c for c in METADATA if c in header]
+
+    days = pd.read_csv(path, usecols=metadata + ['DATE'] + values + mflags + qflags,
+                       dtype=dict.fromkeys(mflags + qflags, str))
+    days['DATE'] = pd.to_datetime(days['DATE'])
+    days = select_period(days, period).sort_values('DATE', kind='stable')
+
+    dates = days['DATE'].values.astype('datetime64[h]')
+    rain = days[values].to_numpy(dtype=np.float64)
+    rain[rain == MISSING_WIDE] = np.nan
+    series = pd.DataFrame({
+        'date': (dates[:, None] + np.arange(24)).ravel().astype('datetime64[ns]'),
+        'val': rain.ravel() / 100,
+        'qflags': flags(days, qflags),
+        'mflags': flags(days, mflags)})
+    return series, station_metadata(days, metadata)
+
+
+def read_long(path, header, period=None):
+    """
+    Read a file in the Climate Data Online layout, see read_hourly.
+    """
+    metadata = [c for c in METADATA if c in header]
+    records = pd.read_csv(path, dtype={c: str for c in header if c != 'HPCP'})
+    records['DATE'] = pd.to_datetime(records['DATE'])
+    records = select_period(records, period).sort_values('DATE', kind='stable')
+
+    if 'Measurement Flag' in records:
+        mflags, qflags = records['Measurement Flag'], records['Quality Flag']
+    elif 'HPCP_ATTRIBUTES' in records:
+        # Attributes are the measurement, quality and source flags separated by commas.
+        attributes = records['HPCP_ATTRIBUTES'].str.split(',', expand=True)
+        mflags, qflags = attributes[0], attributes[1]
+    else:
+        mflags = qflags = np.nan
+
+    series = pd.DataFrame({
+        'date': records['DATE'].values,
+        'val': records['HPCP'].where(records['HPCP'] != MISSING_LONG).values,
+        'qflags': qflags,
+        'mflags': mflags}).replace({'qflags': {'': np.nan, ' ': np.nan},
+                                    'mflags': {'': np.nan, ' ': np.nan}})
+    return series.reset_index(drop=True), station_metadata(records, metadata)
+
+
+def select_period(frame, period):
+    if period is None:
+        return frame
+    years = frame['DATE'].dt.year
+    return frame[(years >= period[0]) & (years <= period[1])]
+
+
+def flags(days, columns):
+    """
+    Flags of each hour of the wide layout, NaN where there are none.
+    """
+    if not columns:
+        return np.nan
+    return days[columns].to_numpy(dtype=object).ravel()
+
+
+def station_metadata(frame, columns):
+    metadata = {c.lower(): frame[c].iloc[0] for c in columns if len(frame)}
+    for key in ('latitude', 'longitude', 'elevation'):
+        if key in metadata:
+            metadata[key] = float(metadata[key])
+    if 'station' in metadata:
+        metadata['id'] = metadata.pop('station')
+    return metadata
+
+
+def convert_file(path, savepath, cache_dir=None, period=None):
+    """
+    Convert a raw NCEI file into savepath/<station>.csv, caching the parsed series if cache_dir is given.
+
+    Parameters
+    ----------
+    Input:
+        path: str, path to the NCEI .csv file, its name without extension is the station name.
+        savepath: str, directory of the converted files, created if it does not exist.
+        cache_dir: str, time series cache directory, see cache.
+        period: tuple of int, first and last year to keep, all years by default.
+    Output:
+        dict, station name, path of the converted file, number of records, first and last
+        date, and the station metadata found in the file.
+    """
+    series, metadata = read_hourly(path, period)
+    os.makedirs(savepath, exist_ok=True)
+    out = os.path.join(savepath, station_name(path) + '.csv')
+    series.to_csv(out)
+
+    if cache_dir is not None:
+        minutes = series['date'].values.astype('datetime64[m]').astype(np.int64)
+        cache.save_series(out, cache_dir, minutes, series['val'].values, 'val')
+
+    summary = {'station': station_name(path), 'path': out, 'records': len(series),
+               'start': series['date'].min(), 'end': series['date'].max()}
+    summary.update(metadata)
+    return summary
+
+
+def _convert(path, savepath, cache_dir, period):
+    try:
+        return convert_file(path, savepath, cache_dir, period), None
+    except Exception:
+        return None, traceback.format_exc().strip().splitlines()[-1]
+
+
+def convert_many(paths, savepath, n_workers=1, cache_dir=None, period=None, metadata=None):
+    """
+    Convert many raw NCEI files in parallel.
+
+    Parameters
+    ----------
+    Input:
+        paths: list of str, raw NCEI files, see batch.find_stations.
+        savepath: str, directory of the converted files, created if it does not exist.
+        n_workers: int, number of worker processes.
+        cache_dir, period: see convert_file.
+        metadata: str, path of a .csv file where the summary of the converted stations is saved.
+                  Kept out of savepath so batch runs over savepath only find station files.
+    Output:
+        stations: DataFrame, one row per converted station, see convert_file.
+        failures: DataFrame, station, path and error of the files not converted.
+    """
+    os.makedirs(savepath, exist_ok=True)
+    arguments = [paths, [savepath] * len(paths), [cache_dir] * len(paths), [period] * len(paths)]
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            results = list(pool.map(_convert, *arguments))
+    else:
+        results = list(map(_convert, *arguments))
+
+    stations = pd.DataFrame([summary for summary, _ in results if summary is not None])
+    failures = pd.DataFrame([{'station': station_name(path), 'path': path, 'error': error}
+                             for path, (_, error) in zip(paths, results) if error is not None],
+                            columns=['station', 'path', 'error'])
+    if metadata is not None:
+        stations.to_csv(metadata, index=False)
+    return stations, failures
+
+
+def main(args):
+    paths = find_stations(args.path)
+    stations, failures = convert_many(paths, args.savepath, n_workers=args.workers,
+                                      cache_dir=args.cache_dir, period=args.period,
+                                      metadata=args.metadata)
+    print("{} stations converted, {} failed".format(len(stations), len(failures)))
+    for _, failure in failures.iterrows():
+        print("{}: {}".format(failure['path'], failure['error']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Convert raw NCEI hourly precipitation files into the time series format read by run.py")
+
+    parser.add_argument("--path", required = True, type = str,
+                        help = "Raw NCEI .csv file, directory of files, manifest file or glob pattern")
+    parser.add_argument("--savepath", required = True, type = str,
+                        help = "Directory where the converted time series are saved")
+    parser.add_argument("--workers", default = 1, type = int,
+                        help = "Number of processes converting files in parallel")
+    parser.add_argument("--cache_dir", default = None, type = str,
+                        help = "Also write the parsed series to this time series cache, see run.py --cache_dir")
+    parser.add_argument("--period", default = None, type = int, nargs = 2,
+                        help = "First and last year to keep, e.g. 1950 2005 to match historical GCM output")
+    parser.add_argument("--metadata", default = None, type = str,
+                        help = "Save the id, name, coordinates and period of the converted stations to this .csv file")
+    args = parser.parse_args()
+
+    main(args)
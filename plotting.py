@@ -0,0 +1,165 @@
+"""
+File name: plotting
+
+##############################
+
+Purpose:
+
+Draw IDF curves without the pyplot state machine, so that figures of many
+stations can be made in one process.
+
+Figures are drawn with the object oriented matplotlib API on the Agg
+canvas, which needs no display. Each process keeps a single Figure that is
+cleared and drawn again for every station, and font sizes are set on each
+artist instead of in the global rcParams. Figures can also be made after
+the IDF of all stations are computed, from their IDF.csv files, spread
+across a pool of worker processes.
+
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import pandas as pd
+import numpy as np
+import traceback
+
+_plotter = None
+
+
+class IDFPlotter:
+
+    """
+    Draw IDF tables on one reusable Figure.
+
+    The IDF table has one row per return period ("2-yr", ...) and one column
+    per duration ("1H", ...). With confidence intervals, the rows also hold the
+    lower and upper bounds of each return period ("L2-yr", "U2-yr", ...) and the
+    curves are drawn against duration instead, with the bounds of the three
+    shortest return periods shaded.
+    """
+
+    def __init__(self):
+        self.figure = Figure()
+        FigureCanvasAgg(self.figure)
+
+    def draw(self, idf, ci=None):
+        """
+        Draw an IDF table on the figure, replacing what was drawn before.
+
+        Parameters
+        ----------
+        Input:
+            idf: DataFrame, IDF table, see IDF.construct_IDF.
+            ci: bool, whether idf has confidence bounds. Inferred from its rows if None.
+        Output:
+            Figure, valid until the next call.
+        """
+        if ci is None:
+            ci = has_bounds(idf)
+
+        fig = self.figure
+        fig.clear()
+        ax = fig.add_subplot()
+
+        if ci:
+            fig.set_size_inches(13, 10)
+            idf_transposed = idf.transpose()
+            means = [x for x in idf_transposed.columns if not is_bound(x)]
+            positions = np.arange(len(idf_transposed.index))
+            for label in means:
+                ax.plot(positions, idf_transposed[label].values, label=label)
+            ax.set_xticks(positions)
+            ax.set_xticklabels(list(idf_transposed.index))
+            # Display the bounds of the three shortest return periods only because others overlap
+            for label in means[:3]:
+                ax.fill_between(positions, idf_transposed['L' + label].values,
+                                idf_transposed['U' + label].values, alpha=0.3)
+            legend = ax.legend(bbox_to_anchor=(1, 0.75), title='Duration', fontsize=13)
+            ax.set_xlabel('Duration', fontsize=18)
+        else:
+            fig.set_size_inches(9, 7)
+            positions = np.arange(len(idf.index))
+            for label in idf.columns:
+                ax.plot(positions, idf[label].values, label=label)
+            ax.set_xticks(positions)
+            ax.set_xticklabels(list(idf.index))
+            legend = ax.legend(bbox_to_anchor=(1, 0.75), title='Duration', fontsize=11)
+            ax.set_xlabel('Average Recurrence Interval', fontsize=18)
+
+        legend.get_title().set_fontsize(15)
+        ax.set_ylabel('Precipitation Depth (in)', fontsize=18)
+        ax.tick_params(labelsize=14)
+        ax.grid()
+        return fig
+
+    def save(self, idf, path, ci=None):
+        """
+        Draw an IDF table and save the figure to path, the format is given by its extension.
+        """
+        self.draw(idf, ci).savefig(path, bbox_inches='tight')
+
+
+def is_bound(label):
+    return label[:1] in ('L', 'U')
+
+
+def has_bounds(idf):
+    """
+    Whether an IDF table holds confidence bounds.
+    """
+    return any(is_bound(str(x)) for x in idf.index)
+
+
+def plotter():
+    """
+    IDFPlotter of this process, created on first use.
+    """
+    global _plotter
+    if _plotter is None:
+        _plotter = IDFPlotter()
+    return _plotter
+
+
+def plot_idf(idf, path, ci=None):
+    """
+    Draw an IDF table with the plotter of this process and save it to path.
+    """
+    plotter().save(idf, path, ci)
+
+
+def plot_idf_file(idf_path, path):
+    """
+    Draw the IDF table saved in idf_path (an IDF.csv file) and save it to path.
+    """
+    plot_idf(pd.read_csv(idf_path, index_col=0), path)
+
+
+def _plot_job(job):
+    try:
+        plot_idf_file(*job)
+    except Exception:
+        return traceback.format_exc().strip().splitlines()[-1]
+    return None
+
+
+def render_figures(jobs, n_workers=1):
+    """
+    Draw many IDF figures from their saved tables.
+
+    Parameters
+    ----------
+    Input:
+        jobs: list of (str, str), path of each IDF.csv file and of its figure.
+        n_workers: int, number of worker processes, figures are drawn in this process if 1.
+    Output:
+        dict, error message of each figure path that could not be drawn.
+    """
+    jobs = list(jobs)
+    if n_workers > 1 and len(jobs) > 1:
+        chunksize = max(1, len(jobs) // (4 * n_workers))
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            errors = list(pool.map(_plot_job, jobs, chunksize=chunksize))
+    else:
+        errors = [_plot_job(job) for job in jobs]
+    return {path: error for (_, path), error in zip(jobs, errors) if error is not None}
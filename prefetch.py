@@ -0,0 +1,81 @@
+"""
+File name: prefetch
+
+##############################
+
+Purpose:
+
+Read the next station files in background threads while the current
+stations are processed, so that disk reads, gzip decompression and csv
+parsing overlap with the AMS and GEV computations.
+
+At most depth files are read ahead of the consumer: a new file is only
+started when a loaded one is taken, so memory stays bounded whatever the
+number of stations.
+
+    with Prefetcher(paths, load_station, depth=4) as loaded:
+        for path, series, error in loaded:
+            ...
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+
+
+class Prefetcher:
+
+    """
+    Load items in background threads, in order and at most depth items ahead.
+
+    Parameters
+    ----------
+    Input:
+        items: iterable, e.g. paths of station files.
+        load: callable, called with each item in a background thread.
+        depth: int, maximum number of items loaded or being loaded that were not taken yet.
+        n_threads: int, number of background threads.
+    """
+
+    def __init__(self, items, load, depth=2, n_threads=1):
+        self.items = iter(items)
+        self.load = load
+        self.depth = max(1, depth)
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+        self.queue = deque()
+
+    def _submit_next(self):
+        for item in self.items:
+            self.queue.append((item, self.executor.submit(self.load, item)))
+            return True
+        return False
+
+    def __iter__(self):
+        """
+        Yield (item, loaded, error) tuples, error being the exception raised by load, or None.
+        """
+        while len(self.queue) < self.depth and self._submit_next():
+            pass
+        while self.queue:
+            item, future = self.queue.popleft()
+            self._submit_next()
+            try:
+                loaded, error = future.result(), None
+            except Exception as e:
+                loaded, error = None, e
+            yield item, loaded, error
+
+    def close(self):
+        """
+        Stop loading, items not started yet are dropped.
+        """
+        for _, future in self.queue:
+            future.cancel()
+        self.queue.clear()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
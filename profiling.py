@@ -0,0 +1,202 @@
+"""
+File name: profiling
+
+##############################
+
+Purpose:
+
+Opt-in timing of the stages of the pipeline (loading the time series,
+the AMS of each duration, each GEV fit, the bootstrap and the plot).
+
+AMS, IDF and run.py mark their stages with the stage context manager,
+which does nothing unless a Profiler is active:
+
+    with profiling.profile('report.json') as profiler:
+        ts = AMS(path, durations)
+        ...
+
+Each stage records its wall time, CPU time and memory, and hooks can be
+registered to receive every record as soon as a stage ends. Optionally
+each stage is also run under cProfile and its statistics dumped to a file.
+
+"""
+
+from contextlib import contextmanager
+import cProfile
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the resident memory is not reported there.
+    resource = None
+
+_active = None
+
+
+class Profiler:
+
+    """
+    Collect one record per stage.
+
+    Parameters
+    ----------
+    Input:
+        cprofile_dir: str, directory where the cProfile statistics of each stage are dumped.
+                Nested stages are included in the statistics of the outermost stage.
+        trace_memory: bool, if True the memory of a stage is its peak allocation traced with
+                tracemalloc, which slows down the run. Otherwise it is the peak resident
+                memory of the process at the end of the stage.
+        hooks: list of callables, each called with the record of a stage when it ends.
+    """
+
+    def __init__(self, cprofile_dir=None, trace_memory=False, hooks=None):
+        self.cprofile_dir = cprofile_dir
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks or [])
+        self.records = []
+        self.labels = {}
+        self._depth = 0
+        self._peaks = []
+        self._cprofile = None
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """
+        Measure the enclosed block as a stage called name, labels are added to its record.
+        """
+        labels = dict(self.labels, **labels)
+        record = {'stage': name, 'depth': self._depth}
+        record.update(labels)
+
+        profile = None
+        if self.cprofile_dir is not None and self._cprofile is None:
+            profile = self._cprofile = cProfile.Profile()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # Resetting the peak loses the peak of the enclosing stage so far, keep it aside.
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+            traced = tracemalloc.get_traced_memory()[0]
+
+        self._depth += 1
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._cprofile = None
+            record['wall_s'] = time.perf_counter() - wall
+            record['cpu_s'] = time.process_time() - cpu
+            self._depth -= 1
+
+            if self.trace_memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = (peak - traced) / 1e6
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            else:
+                record['max_rss_mb'] = max_rss_mb()
+
+            if profile is not None:
+                os.makedirs(self.cprofile_dir, exist_ok=True)
+                name_parts = [str(len(self.records)), name] + \
+                    ['{}'.format(v) for v in labels.values()]
+                filename = '_'.join(name_parts).replace(os.sep, '-') + '.prof'
+                record['cprofile'] = os.path.join(self.cprofile_dir, filename)
+                profile.dump_stats(record['cprofile'])
+
+            self.records.append(record)
+            for hook in self.hooks:
+                hook(record)
+
+    def report(self):
+        """
+        Records of all stages, and the total wall and CPU time per stage name.
+        """
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0})
+            total['count'] += 1
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+        return {'stages': self.records, 'totals': totals}
+
+    def save(self, path):
+        """
+        Save the report as JSON.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=1, default=str)
+
+
+def max_rss_mb():
+    """
+    Peak resident memory of the process, in MB, None if it is not available.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere.
+    return rss / 1e6 if sys.platform == 'darwin' else rss / 1e3
+
+
+@contextmanager
+def profile(report_path=None, **kwargs):
+    """
+    Activate a Profiler for the enclosed block, saving its report to report_path if given.
+
+    Keyword arguments are passed to Profiler. Yields the Profiler.
+    """
+    global _active
+    previous, _active = _active, Profiler(**kwargs)
+    profiler = _active
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        if report_path is not None:
+            profiler.save(report_path)
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Mark the enclosed block as a stage of the active Profiler, do nothing if there is none.
+    """
+    if _active is None:
+        yield None
+    else:
+        with _active.stage(name, **labels) as record:
+            yield record
+
+
+def profiled(name):
+    """
+    Decorator marking every call of a function as a stage called name.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def active():
+    """
+    The active Profiler, None if profiling is off.
+    """
+    return _active
@@ -0,0 +1,387 @@
+"""
+File name: regional
+
+##############################
+
+Purpose:
+
+Regional frequency analysis of the AMS of many stations with the
+index-flood method based on L-moments, following
+
+Hosking, J. R. M., & Wallis, J. R. (1997). Regional Frequency Analysis:
+An Approach Based on L-Moments. Cambridge University Press.
+https://doi.org/10.1017/CBO9780511529443
+
+Stations are grouped in regions, and the AMS of every station of a region
+are assumed to share the same distribution up to a scale factor, the index
+flood (the mean of the AMS of the station). The L-moment ratios of the
+region are the averages of those of its stations weighted by record length,
+and the regional growth curve is the GEV distribution with these ratios and
+mean 1. The rainfall depth of a station for a return period is its index
+flood times the growth curve, so short records borrow the information of
+the whole region instead of relying on their own bootstrap.
+
+The AMS of all stations are kept in a single (station, duration, year)
+array padded with NaN, so the L-moment ratios, the regional averages and
+the quantiles of all stations and durations are computed at once. Only the
+homogeneity simulations loop, over regions and durations.
+
+Regions are formed by k-means on station characteristics, e.g. latitude and
+longitude, or on the L-CV and L-skewness of the stations if none are given.
+For each region and duration, the discordancy of each station and the
+heterogeneity measure H (based on L-CV, simulated from the regional GEV
+rather than the kappa distribution) are reported: H below 1 is acceptably
+homogeneous, above 2 definitely heterogeneous.
+
+"""
+
+from constructIDF import return_levels
+from store import ResultStore
+import lmoments
+import pandas as pd
+import numpy as np
+import argparse
+import glob
+import os
+
+
+def read_ams(source):
+    """
+    Read the AMS of many stations.
+
+    Parameters
+    ----------
+    Input:
+        source: str or dict, a ResultStore directory, a directory with one <station>/AMS.csv per
+                station (the savepath of a batch run), or a dict of AMS DataFrames by station, in
+                the format of AMS.calculate_AMS.
+    Output:
+        tables: dict, AMS DataFrame by station.
+    """
+    if isinstance(source, dict):
+        return source
+    if os.path.exists(os.path.join(source, 'meta.json')):
+        results = ResultStore(source)
+        return {station: results.ams(station) for station in results.stations()}
+    paths = sorted(glob.glob(os.path.join(source, '*', 'AMS.csv')))
+    return {os.path.basename(os.path.dirname(path)): pd.read_csv(path, index_col=0)
+            for path in paths}
+
+
+def ams_cube(tables):
+    """
+    Stack the AMS of many stations in one array.
+
+    Parameters
+    ----------
+    Input:
+        tables: dict, AMS DataFrame by station, see read_ams. All stations must have the same durations.
+    Output:
+        stations: list of str, station of each row.
+        durations: list of str, duration of each column.
+        cube: numpy array, (stations, durations, years) AMS, the years of each station first and
+              padded with NaN up to the longest record.
+    """
+    stations = list(tables)
+    durations = [c for c in tables[stations[0]].columns if c != 'year']
+    values = [tables[station][durations].values.astype(float) for station in stations]
+    lengths = np.array([len(v) for v in values])
+
+    cube = np.full((len(stations), len(durations), lengths.max()), np.nan)
+    rows = np.repeat(np.arange(len(stations)), lengths)
+    years = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cube[rows, :, years] = np.concatenate(values)
+    return stations, durations, cube
+
+
+def kmeans(features, n_regions, seed=None, iterations=100):
+    """
+    Group rows of features in n_regions clusters with k-means, started with k-means++.
+
+    Parameters
+    ----------
+    Input:
+        features: numpy array, (stations, features), already scaled.
+        n_regions: int, number of clusters.
+        seed: int, seed of the initial centers.
+        iterations: int, maximum number of iterations.
+    Output:
+        numpy array, region of each station, from 0 to n_regions - 1.
+    """
+    rng = np.random.default_rng(seed)
+    centers = features[[rng.integers(len(features))]]
+    while len(centers) < n_regions:
+        distance = ((features[:, None] - centers[None]) ** 2).sum(axis=-1).min(axis=1)
+        # Stations that are all identical to the centers are drawn uniformly.
+        p = distance / distance.sum() if distance.sum() > 0 else None
+        centers = np.vstack([centers, features[rng.choice(len(features), p=p)]])
+
+    labels = None
+    for _ in range(iterations):
+        distance = ((features[:, None] - centers[None]) ** 2).sum(axis=-1)
+        new_labels = distance.argmin(axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=n_regions)
+        sums = np.stack([np.bincount(labels, features[:, k], minlength=n_regions)
+                         for k in range(features.shape[1])], axis=1)
+        # Empty clusters keep their center.
+        centers = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+    return labels
+
+
+def form_regions(ratios, n_regions, features=None, seed=None):
+    """
+    Assign each station to a region.
+
+    Parameters
+    ----------
+    Input:
+        ratios: tuple, L-moment ratios (l1, t, t3, t4, n) of each (station, duration), see
+                lmoments.lmoment_ratios.
+        n_regions: int, number of regions.
+        features: numpy array, (stations, features) station characteristics, e.g. latitude and
+                  longitude. The L-CV and L-skewness of every duration are used if None.
+        seed: int, seed of the k-means initial centers.
+    Output:
+        numpy array, region of each station.
+    """
+    if features is None:
+        features = np.concatenate([ratios[1], ratios[2]], axis=1)
+    features = np.asarray(features, dtype=float)
+    # Missing values take the mean of their column, then all columns are standardized.
+    features = np.where(np.isnan(features), np.nanmean(features, axis=0), features)
+    spread = features.std(axis=0)
+    features = (features - features.mean(axis=0)) / np.where(spread > 0, spread, 1)
+    return kmeans(features, min(n_regions, len(features)), seed)
+
+
+def regional_ratios(ratios, regions, n_regions):
+    """
+    Regional L-moment ratios, averages of those of the stations weighted by record length.
+
+    Output:
+        t, t3, t4: numpy arrays, (regions, durations) regional L-CV, L-skewness and L-kurtosis.
+    """
+    _, t, t3, t4, n = ratios
+    durations = t.shape[1]
+    # One bincount over (region, duration) pairs gives the weighted sums of all regions at once.
+    index = (regions[:, None] * durations + np.arange(durations)).ravel()
+    valid = ~np.isnan(t)
+    weights = np.where(valid, n, 0).ravel()
+    total = np.bincount(index, weights, minlength=n_regions * durations)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return tuple((np.bincount(index, weights * np.nan_to_num(r).ravel(), minlength=n_regions * durations)
+                      / total).reshape(n_regions, durations) for r in (t, t3, t4))
+
+
+def growth_curves(t, t3):
+    """
+    GEV growth curve, the distribution with mean 1, L-CV t and L-skewness t3.
+
+    Output:
+        numpy array, (..., 3) GEV (shape, location, scale) parameters.
+    """
+    return lmoments.gev_from_lmoments(np.ones_like(t), t, t3)
+
+
+def discordancy(ratios, regions, n_regions):
+    """
+    Discordancy measure of each station within its region, for each duration.
+
+    Stations with a discordancy above 3 have L-moment ratios unlike the rest of their region,
+    and their data or region should be checked. Regions with less than 4 stations give NaN.
+
+    Output:
+        numpy array, (stations, durations) discordancy.
+    """
+    u = np.stack(ratios[1:4], axis=-1)
+    result = np.full(u.shape[:2], np.nan)
+    for region in range(n_regions):
+        members = np.flatnonzero(regions == region)
+        if len(members) < 4:
+            continue
+        deviations = u[members] - np.nanmean(u[members], axis=0)
+        deviations = np.nan_to_num(deviations)
+        scatter = np.einsum('sdi,sdj->dij', deviations, deviations)
+        with np.errstate(invalid='ignore'):
+            inverse = np.linalg.pinv(scatter)
+        result[members] = len(members) / 3 * np.einsum('sdi,dij,sdj->sd', deviations, inverse, deviations)
+    return result
+
+
+def lcv_dispersion(t, n):
+    """
+    Weighted standard deviation of the L-CV of the stations of a region, along the last axis.
+    """
+    weights = np.where(np.isnan(t), 0, n)
+    t = np.nan_to_num(t)
+    mean = (weights * t).sum(axis=-1, keepdims=True) / weights.sum(axis=-1, keepdims=True)
+    return np.sqrt((weights * (t - mean) ** 2).sum(axis=-1) / weights.sum(axis=-1))
+
+
+def simulated_lcv(growth, sizes, n_simulations, rng, chunk=2**22):
+    """
+    L-CV of the stations of homogeneous regions drawn from a growth curve.
+
+    Parameters
+    ----------
+    Input:
+        growth: numpy array, (3,) GEV (shape, location, scale) parameters of the growth curve.
+        sizes: numpy array, record length of each station of the region.
+        n_simulations: int, number of simulated regions.
+        rng: numpy.random.Generator.
+        chunk: int, maximum number of values drawn at a time, which bounds the memory used.
+    Output:
+        numpy array, (n_simulations, stations) L-CV.
+    """
+    width = sizes.max()
+    j = np.arange(width)
+    valid = j < sizes[:, None]
+    # Weights of the unbiased estimator of b1 for each station, 0 beyond its record.
+    w1 = np.where(valid, j / np.maximum(sizes[:, None] - 1, 1), 0.0)
+    c, loc, scale = growth
+
+    lcv = []
+    step = max(1, chunk // (len(sizes) * width))
+    for lo in range(0, n_simulations, step):
+        # Values beyond each record are drawn too and pushed to the end by the sort, where
+        # their weights are 0, and the quantile function is increasing, so sorting the
+        # uniforms sorts the samples.
+        u = np.sort(np.where(valid, rng.random((min(step, n_simulations - lo), len(sizes), width)), 2.0),
+                    axis=-1)
+        log_y = np.log(-np.log(np.where(valid, u, 0.5)))
+        x = loc - scale * (np.expm1(c * log_y) / c if abs(c) > 1e-9 else log_y)
+        b0 = np.einsum('snj,nj->sn', x, valid.astype(float)) / sizes
+        b1 = np.einsum('snj,nj->sn', x, w1) / sizes
+        lcv.append((2 * b1 - b0) / b0)
+    return np.concatenate(lcv)
+
+
+def heterogeneity(ratios, regions, n_regions, growth, n_simulations=500, seed=None):
+    """
+    Heterogeneity measure H of each region and duration.
+
+    The dispersion of the L-CV of the stations is compared with its distribution over
+    n_simulations homogeneous regions with the same record lengths, see simulated_lcv.
+
+    Output:
+        numpy array, (regions, durations) H, NaN for regions with less than 2 stations.
+    """
+    _, t, _, _, n = ratios
+    rng = np.random.default_rng(seed)
+    result = np.full((n_regions, t.shape[1]), np.nan)
+    for region in range(n_regions):
+        for d in range(t.shape[1]):
+            members = np.flatnonzero((regions == region) & (n[:, d] >= 4))
+            if len(members) < 2 or np.isnan(growth[region, d]).any():
+                continue
+            sizes = n[members, d]
+            observed = lcv_dispersion(t[members, d], sizes)
+            simulated = lcv_dispersion(simulated_lcv(growth[region, d], sizes, n_simulations, rng), sizes)
+            result[region, d] = (observed - simulated.mean()) / simulated.std()
+    return result
+
+
+def regional_idf(tables, n_regions, return_periods=(2, 5, 10, 25, 50, 100, 200), features=None,
+                 seed=None, n_simulations=500):
+    """
+    Rainfall depths of every station by regional frequency analysis.
+
+    Parameters
+    ----------
+    Input:
+        tables: dict, AMS DataFrame by station, see read_ams.
+        n_regions: int, number of regions.
+        return_periods: list of float, return periods in years.
+        features: DataFrame, station characteristics used to form the regions, indexed by station,
+                  see form_regions.
+        seed: int, seed of the regions and of the homogeneity simulations.
+        n_simulations: int, number of simulated regions of the heterogeneity measure, 0 to skip it.
+    Output:
+        idf: DataFrame, station, return_period and one column per duration, as the summary of a batch run.
+        stations: DataFrame, region, index flood and discordancy of each station and duration.
+        regions: DataFrame, number of stations, regional L-moment ratios, growth curve and H of each
+                 region and duration.
+    """
+    stations, durations, cube = ams_cube(tables)
+    ratios = lmoments.lmoment_ratios(cube)
+    if features is not None:
+        features = features.reindex(stations)
+        missing = features.index[features.isna().all(axis=1)]
+        if len(missing):
+            raise ValueError("No station characteristics for {}".format(', '.join(map(str, missing))))
+        features = features.values
+    labels = form_regions(ratios, n_regions, features, seed)
+    n_regions = labels.max() + 1
+
+    t, t3, t4 = regional_ratios(ratios, labels, n_regions)
+    growth = growth_curves(t, t3)
+    # (regions, durations, return periods) growth factors, scaled by the index flood of each station.
+    factors = return_levels(growth, [1 / T for T in return_periods])
+    depths = ratios[0][:, :, None] * factors[labels]
+
+    rows = ["{:g}-yr".format(T) for T in return_periods]
+    idf = pd.DataFrame(depths.transpose(0, 2, 1).reshape(-1, len(durations)), columns=durations)
+    idf.insert(0, 'return_period', np.tile(rows, len(stations)))
+    idf.insert(0, 'station', np.repeat(stations, len(rows)))
+
+    station_table = pd.DataFrame({
+        'station': np.repeat(stations, len(durations)),
+        'duration': np.tile(durations, len(stations)),
+        'region': np.repeat(labels, len(durations)),
+        'years': ratios[4].ravel(),
+        'index_flood': ratios[0].ravel(),
+        'discordancy': discordancy(ratios, labels, n_regions).ravel()})
+
+    h = heterogeneity(ratios, labels, n_regions, growth, n_simulations, seed) if n_simulations \
+        else np.full(t.shape, np.nan)
+    region_table = pd.DataFrame({
+        'region': np.repeat(np.arange(n_regions), len(durations)),
+        'duration': np.tile(durations, n_regions),
+        'stations': np.repeat(np.bincount(labels, minlength=n_regions), len(durations)),
+        't': t.ravel(), 't3': t3.ravel(), 't4': t4.ravel(),
+        'shape': growth[..., 0].ravel(), 'loc': growth[..., 1].ravel(), 'scale': growth[..., 2].ravel(),
+        'H': h.ravel()})
+    return idf, station_table, region_table
+
+
+def main(args):
+    tables = read_ams(args.path)
+    features = None
+    if args.features is not None:
+        features = pd.read_csv(args.features, dtype={'station': str}).set_index('station')[args.feature_columns]
+
+    idf, stations, regions = regional_idf(tables, args.n_regions, args.return_periods, features=features,
+                                          seed=args.seed, n_simulations=args.n_simulations)
+    os.makedirs(args.savepath, exist_ok=True)
+    idf.to_csv(os.path.join(args.savepath, 'regional_idf.csv'), index=False)
+    stations.to_csv(os.path.join(args.savepath, 'regional_stations.csv'), index=False)
+    regions.to_csv(os.path.join(args.savepath, 'regions.csv'), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Regional frequency analysis of the AMS of many stations with the L-moment index-flood method")
+
+    parser.add_argument("--path", required = True, type = str,
+                        help = "Savepath of a batch run (one <station>/AMS.csv per station) or a --store directory")
+    parser.add_argument("--n_regions", default = 5, type = int,
+                        help = "Number of regions, default 5")
+    parser.add_argument("--return_periods", default = [2, 5, 10, 25, 50, 100, 200], type = float, nargs = '+',
+                        help = "Return periods in years, default 2 5 10 25 50 100 200")
+    parser.add_argument("--features", default = None, type = str,
+                        help = "Csv file of station characteristics with a station column, e.g. the --metadata of ingest.py. "
+                               "Regions are formed on the L-moment ratios of the stations if not given")
+    parser.add_argument("--feature_columns", default = ['latitude', 'longitude'], type = str, nargs = '+',
+                        help = "Columns of --features used to form the regions, default latitude longitude")
+    parser.add_argument("--n_simulations", default = 500, type = int,
+                        help = "Number of simulated regions of the heterogeneity measure, 0 to skip it, default 500")
+    parser.add_argument("--seed", default = None, type = int,
+                        help = "Seed of the regions and of the heterogeneity simulations")
+    parser.add_argument("--savepath", required = True, type = str,
+                        help = "Directory where regional_idf.csv, regional_stations.csv and regions.csv are saved")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,301 @@
+"""
+File name: registry
+
+##############################
+
+Purpose:
+
+Answer "IDF at this point" from precomputed station results.
+
+A StationRegistry holds the metadata and the IDF of many stations, read
+from a ResultStore, the summary.csv of a batch run or the regional_idf.csv
+of regional.py, joined on the station coordinates saved by ingest.py
+--metadata. Stations are indexed with a KD-tree over their positions as
+unit vectors on the sphere, so the straight line distances of the tree
+order neighbours exactly as great-circle distances do, at any latitude and
+across the antimeridian.
+
+The depths of all stations are kept in one (bound, station, return period
+x duration) array. A query of many points is one tree query followed by a
+gather and a weighted sum over the k nearest stations, so thousands of
+points are answered per call, and a single point takes a fraction of a
+millisecond. With k = 1 the depths are those of the nearest station,
+otherwise they are the inverse distance weighted average of the k nearest
+stations, ignoring the neighbours without a value for a duration.
+
+    registry = StationRegistry.from_results(store_path, 'stations_metadata.csv')
+    registry.idf(40.44, -79.99, k=4)          # IDF table of one point
+    registry.query(lats, lons, k=4)           # (points, return periods, durations)
+
+"""
+
+from scipy.spatial import cKDTree
+from store import ResultStore, BOUNDS, PREFIXES
+import pandas as pd
+import numpy as np
+import argparse
+import os
+
+EARTH_RADIUS = 6371.0088
+# Distances are at least 1 m, so a station at the point itself gets all the weight.
+MIN_DISTANCE = 1e-3
+
+
+def unit_vectors(lat, lon):
+    """
+    Positions on the unit sphere of coordinates in degrees.
+
+    Parameters
+    ----------
+    Input:
+        lat, lon: array-like, latitudes and longitudes in degrees.
+    Output:
+        numpy array, (points, 3).
+    """
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    """
+    Great-circle distance in km of a straight line distance between unit vectors, inf stays inf.
+    """
+    with np.errstate(invalid='ignore'):
+        return np.where(np.isfinite(chord), 2 * EARTH_RADIUS * np.arcsin(np.minimum(chord / 2, 1)), np.inf)
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(km / (2 * EARTH_RADIUS), np.pi / 2))
+
+
+def read_idf(source):
+    """
+    Read the IDF of many stations.
+
+    Parameters
+    ----------
+    Input:
+        source: str, a ResultStore directory, a batch savepath with a summary.csv, or a .csv file
+                in the layout of summary.csv (e.g. regional_idf.csv).
+    Output:
+        stations: list of str, station identifiers.
+        return_periods: list of str, return period labels, e.g. "2-yr".
+        durations: list of str, duration labels, e.g. "1H".
+        depths: numpy array, (bound, station, return period, duration), bounds being the lower
+                bound, the estimate and the upper bound, NaN when there are no confidence intervals.
+    """
+    if os.path.exists(os.path.join(source, 'meta.json')):
+        results = ResultStore(source)
+        stations = results.stations()
+        depths = np.stack([np.stack([results.duration(d, bound).values for d in results.durations], axis=-1)
+                           for bound in BOUNDS])
+        return stations, results.return_periods, results.durations, depths
+
+    if os.path.isdir(source):
+        source = os.path.join(source, 'summary.csv')
+    summary = pd.read_csv(source, dtype={'station': str, 'return_period': str})
+    durations = [c for c in summary.columns if c not in ('station', 'return_period')]
+    labels = summary['return_period']
+    return_periods = list(pd.unique(labels[~labels.str[:1].isin(['L', 'U'])]))
+    stations = list(pd.unique(summary['station']))
+
+    table = summary.set_index(['station', 'return_period'])[durations]
+    depths = np.full((len(BOUNDS), len(stations), len(return_periods), len(durations)), np.nan)
+    for b, prefix in enumerate(PREFIXES):
+        rows = pd.MultiIndex.from_product([stations, [prefix + x for x in return_periods]])
+        values = table.reindex(rows).values.astype(float)
+        depths[b] = values.reshape(len(stations), len(return_periods), len(durations))
+    return stations, return_periods, durations, depths
+
+
+class StationRegistry:
+
+    """
+    Station metadata and IDF indexed by location.
+
+    Parameters
+    ----------
+    Input:
+        metadata: DataFrame, indexed by station, with latitude and longitude columns in degrees,
+                  e.g. the --metadata file of ingest.py. Other columns are kept.
+        depths: numpy array, (bound, station, return period, duration), see read_idf.
+        stations: list of str, station of each row of depths.
+        return_periods, durations: list of str, labels of the return periods and durations of depths.
+
+    Stations without coordinates or without IDF are left out, see self.stations.
+    """
+
+    def __init__(self, metadata, depths, stations, return_periods, durations):
+        metadata = metadata[~metadata.index.duplicated(keep='last')]
+        known = metadata[['latitude', 'longitude']].reindex(stations).notna().all(axis=1).values
+        if not known.any():
+            raise ValueError("None of the {} stations with IDF has coordinates".format(len(stations)))
+
+        self.stations = np.asarray(stations, dtype=object)[known]
+        self.metadata = metadata.loc[self.stations]
+        self.return_periods = list(return_periods)
+        self.durations = list(durations)
+        # (bound, station, return period x duration), so neighbours are gathered with one take.
+        self.depths = np.ascontiguousarray(np.asarray(depths, dtype=float)[:, known].reshape(
+            len(BOUNDS), known.sum(), -1))
+        self.tree = cKDTree(unit_vectors(self.metadata['latitude'].values, self.metadata['longitude'].values))
+
+    @classmethod
+    def from_results(cls, source, metadata):
+        """
+        Build a registry from saved results.
+
+        Parameters
+        ----------
+        Input:
+            source: str, IDF results, see read_idf.
+            metadata: str or DataFrame, .csv file or table of the stations with station, latitude
+                      and longitude columns.
+        """
+        if not isinstance(metadata, pd.DataFrame):
+            metadata = pd.read_csv(metadata, dtype={'station': str})
+        if 'station' in metadata:
+            metadata = metadata.set_index('station')
+        stations, return_periods, durations, depths = read_idf(source)
+        return cls(metadata, depths, stations, return_periods, durations)
+
+    def __len__(self):
+        return len(self.stations)
+
+    def nearest(self, lat, lon, k=1, max_distance=None):
+        """
+        Nearest stations of many points.
+
+        Parameters
+        ----------
+        Input:
+            lat, lon: float or array-like, coordinates of the points in degrees.
+            k: int, number of stations per point.
+            max_distance: float, stations farther than this many km are not returned.
+        Output:
+            rows: numpy array, (points, k) rows of the stations in self.stations, len(self) where
+                  there is no station.
+            distances: numpy array, (points, k) great-circle distances in km, inf where there is no station.
+        """
+        points = np.atleast_2d(unit_vectors(lat, lon))
+        valid = np.isfinite(points).all(axis=1)
+        points[~valid] = 0
+        bound = np.inf if max_distance is None else km_to_chord(max_distance)
+        chords, rows = self.tree.query(points, k=k, distance_upper_bound=bound)
+        chords, rows = chords.reshape(len(points), k), rows.reshape(len(points), k)
+        chords[~valid], rows[~valid] = np.inf, len(self)
+        return rows, chord_to_km(chords)
+
+    def query(self, lat, lon, k=1, power=2, bound='estimate', max_distance=None):
+        """
+        Rainfall depths at many points.
+
+        Parameters
+        ----------
+        Input:
+            lat, lon: float or array-like, coordinates of the points in degrees.
+            k: int, number of nearest stations averaged, 1 for the depths of the nearest station.
+            power: float, the weight of each station is its distance to the power -power.
+                   A station at the point itself gets all the weight, unless it has no value.
+            bound: str, one of "lower", "estimate" or "upper".
+            max_distance: float, only stations closer than this many km are used, NaN where there are none.
+        Output:
+            numpy array, (points, return periods, durations).
+        """
+        rows, distances = self.nearest(lat, lon, k, max_distance)
+        found = rows < len(self)
+        values = self.depths[BOUNDS.index(bound)].take(np.where(found, rows, 0), axis=0)
+        values[~found] = np.nan
+        weights = (np.maximum(distances, MIN_DISTANCE) ** -float(power))[:, :, None]
+
+        present = ~np.isnan(values)
+        total = (weights * present).sum(axis=1)
+        with np.errstate(invalid='ignore'):
+            interpolated = (weights * np.where(present, values, 0)).sum(axis=1) / total
+        interpolated[total == 0] = np.nan
+        return interpolated.reshape(len(rows), len(self.return_periods), len(self.durations))
+
+    def idf(self, lat, lon, k=1, power=2, bound='estimate', max_distance=None):
+        """
+        IDF table at one point, laid out as IDF.csv, see query.
+        """
+        depths = self.query(lat, lon, k, power, bound, max_distance)[0]
+        return pd.DataFrame(depths, index=self.return_periods, columns=self.durations)
+
+    def lookup(self, points, k=1, power=2, bounds=('estimate',), max_distance=None):
+        """
+        IDF tables of many points, laid out as summary.csv.
+
+        Parameters
+        ----------
+        Input:
+            points: DataFrame, with latitude and longitude columns, other columns identify the points.
+            bounds: list of str, bounds returned, rows of the lower and upper bounds are prefixed
+                    with L and U as in IDF.csv.
+            k, power, max_distance: see query.
+        Output:
+            DataFrame, one row per point and return period, with the columns of points, the
+            nearest station and its distance in km, a return_period column and one column per duration.
+        """
+        lat, lon = points['latitude'].values, points['longitude'].values
+        rows, distances = self.nearest(lat, lon, 1, max_distance)
+        nearest = np.append(self.stations, None)[rows[:, 0]]
+
+        tables = []
+        for bound in bounds:
+            depths = self.query(lat, lon, k, power, bound, max_distance)
+            prefix = PREFIXES[BOUNDS.index(bound)]
+            table = points.loc[points.index.repeat(len(self.return_periods))].reset_index(drop=True)
+            table['nearest_station'] = np.repeat(nearest, len(self.return_periods))
+            table['nearest_distance'] = np.repeat(distances[:, 0], len(self.return_periods))
+            table['return_period'] = np.tile([prefix + x for x in self.return_periods], len(points))
+            table[self.durations] = depths.reshape(-1, len(self.durations))
+            tables.append(table)
+        return pd.concat(tables, ignore_index=True)
+
+
+def main(args):
+    registry = StationRegistry.from_results(args.path, args.metadata)
+    if args.points is not None:
+        points = pd.read_csv(args.points)
+    else:
+        points = pd.DataFrame({'latitude': [args.lat], 'longitude': [args.lon]})
+    table = registry.lookup(points, k=args.k, power=args.power, bounds=args.bounds,
+                            max_distance=args.max_distance)
+    if args.savepath is not None:
+        table.to_csv(args.savepath, index=False)
+    else:
+        print(table.to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Rainfall depths at given locations from the IDF of the nearest stations")
+
+    parser.add_argument("--path", required = True, type = str,
+                        help = "A --store directory, the savepath of a batch run or a .csv file laid out as summary.csv")
+    parser.add_argument("--metadata", required = True, type = str,
+                        help = "Csv file with station, latitude and longitude columns, e.g. the --metadata of ingest.py")
+    parser.add_argument("--points", default = None, type = str,
+                        help = "Csv file with latitude and longitude columns, other columns are copied to the output")
+    parser.add_argument("--lat", default = None, type = float,
+                        help = "Latitude of a single point, if --points is not given")
+    parser.add_argument("--lon", default = None, type = float,
+                        help = "Longitude of a single point, if --points is not given")
+    parser.add_argument("--k", default = 1, type = int,
+                        help = "Number of nearest stations averaged, 1 for the depths of the nearest station, default 1")
+    parser.add_argument("--power", default = 2, type = float,
+                        help = "Power of the inverse distance weights, default 2")
+    parser.add_argument("--max_distance", default = None, type = float,
+                        help = "Only use stations closer than this many km")
+    parser.add_argument("--bounds", default = ['estimate'], type = str, nargs = '+',
+                        choices = ['lower', 'estimate', 'upper'],
+                        help = "Bounds of the depths returned, default estimate")
+    parser.add_argument("--savepath", default = None, type = str,
+                        help = "Csv file where the depths are saved, printed if not given")
+    args = parser.parse_args()
+
+    if args.points is None and (args.lat is None or args.lon is None):
+        parser.error("give either --points or both --lat and --lon")
+    main(args)
@@ -1,31 +1,88 @@
 from constructIDF import *
+from batch import find_stations, run_batch, station_name
+from incremental import update_station
+import profiling
+from store import ResultStore
 import pandas as pd
 import numpy as np
 import itertools
 import argparse
 
 
+def duration(text):
+    """
+    Duration given on the command line, an integer number of hours (records with --timestep records)
+    or a time span such as 15min.
+    """
+    return int(text) if text.isdigit() else text
+
+
 def main(args):
 
     ftype = args.ftype
     fpath = args.path
 
-    # Hard coded durations here, but could be input from the user
-    durations = [1, 2, 3, 6, 12, 24, 48, 72]
+    durations = args.durations
+    if args.timestep == 'records':
+        args.timestep = None
+
+    if args.batch:
+        run_batch(find_stations(args.path), args.savepath, n_workers=args.workers,
+                  retries=args.retries, durations=durations, ftype=args.ftype,
+                  ci=args.ci, number_bootstrap=args.number_bootstrap, alpha=args.alpha,
+                  method=args.method, seed=args.seed,
+                  figformat=None if args.plot == 'none' else args.figformat,
+                  defer_plots=args.plot == 'defer', store=args.store, prefetch=args.prefetch,
+                  cache_dir=args.cache_dir, chunksize=args.chunksize,
+                  incremental=args.incremental, profile=args.profile,
+                  profile_dir=args.profile_dir, timestep=args.timestep,
+                  min_completeness=args.min_completeness, fit_cache=args.fit_cache,
+                  fit_cache_size=args.fit_cache_size * 2**20, return_periods=args.return_periods,
+                  ci_method=args.ci_method)
+    elif args.profile:
+        with profiling.profile(args.profile, cprofile_dir=args.profile_dir) as profiler:
+            profiler.labels['station'] = station_name(args.path)
+            station(args, durations)
+    else:
+        station(args, durations)
+
+
+def station(args, durations):
+
+    if args.incremental:
+        out, data, updated = update_station(
+            args.path, args.savepath, durations, args.ftype, ci=args.ci,
+            number_bootstrap=args.number_bootstrap, alpha=args.alpha, n_jobs=args.n_jobs,
+            seed=args.seed, method=args.method, cache_dir=args.cache_dir,
+            timestep=args.timestep, min_completeness=args.min_completeness,
+            fit_cache=args.fit_cache, fit_cache_size=args.fit_cache_size * 2**20,
+            return_periods=args.return_periods, ci_method=args.ci_method)
+        print("AMS updated for {} years, GEV fitted for {} durations".format(
+            len(updated['years']), len(updated['durations'])))
+    else:
+        ts = AMS(args.path, durations, cache_dir=args.cache_dir,
+                 chunksize=args.chunksize, timestep=args.timestep)
 
-    ts = AMS(args.path, durations)
+        out, completeness = ts.calculate_AMS(
+            args.ftype, min_completeness=args.min_completeness, return_completeness=True)
 
-    out = ts.calculate_AMS(args.ftype)
+        if args.saveAMS == True:
+            out.to_csv("{}/AMS.csv".format(args.savepath))
+            completeness.to_csv("{}/completeness.csv".format(args.savepath))
 
-    if args.saveAMS == True:
-        out.to_csv("{}/AMS.csv".format(args.savepath)]))
+        data=IDF(out, args.ci, args.number_bootstrap, args.alpha,
+                 n_jobs=args.n_jobs, seed=args.seed, method=args.method,
+                 fit_cache=args.fit_cache, fit_cache_size=args.fit_cache_size * 2**20,
+                 return_periods=args.return_periods, ci_method=args.ci_method)
+        data.construct_IDF()
 
-    data=IDF(out, args.ci, args.number_bootstrap, args.alpha)
-    data.construct_IDF()
+        data.idf.to_csv("{}/IDF.csv".format(args.savepath))
 
-    data.idf.to_csv("{}/IDF.csv".format(args.savepath))
+    if args.store is not None:
+        ResultStore(args.store).append(station_name(args.path), data.idf, out)
 
-    data.plot_IDF(args.figformat, args.savepath)
+    if args.plot != 'none':
+        data.plot_IDF(args.savepath, args.figformat)
 
 
 if __name__ == "__main__":
@@ -33,21 +90,70 @@ if __name__ == "__main__":
         "Extract the annual maximum precipitation (AMS) from a precipitation time series")
 
     parser.add_argument("--path", required = True, type = str,
-                        help = "Full path where the .csv file of hourly rainfall records is located.")
+                        help = "Full path where the .csv file of hourly rainfall records is located. "
+                               "With --batch, a directory, a glob pattern or a manifest file (not .csv) listing one station file per line.")
+    parser.add_argument("--batch", action = "store_true",
+                        help = "Process every station given by --path, saving the outputs of each station to its own directory")
+    parser.add_argument("--workers", default = 1, type = int,
+                        help = "Number of stations processed in parallel in batch mode, default 1")
+    parser.add_argument("--prefetch", default = 0, type = int,
+                        help = "With --batch, read this many station files ahead of the workers in a background thread, "
+                               "so reading and parsing overlap with the fits. Default 0, each worker reads its own file")
+    parser.add_argument("--retries", default = 1, type = int,
+                        help = "Number of times a failed station is retried in batch mode before it is skipped, default 1")
     parser.add_argument("--saveAMS", default = True, type = bool,
                         help = "Option to save the AMS")
     parser.add_argument("--ftype", required = True, type = str,
                         help = "Type of approach. There are only two options: 'sliding' or 'fixed'")
+    parser.add_argument("--durations", default = [1, 2, 3, 6, 12, 24, 48, 72], type = duration, nargs = '+',
+                        help = "Durations of the AMS, in hours or as time spans such as 15min, default 1 2 3 6 12 24 48 72")
+    parser.add_argument("--return_periods", default = [2, 5, 10, 25, 50, 100, 200], type = float, nargs = '+',
+                        help = "Return periods of the IDF in years, default 2 5 10 25 50 100 200")
+    parser.add_argument("--timestep", default = 'auto', type = str,
+                        help = "Time step of the records, e.g. 15min or 1H, inferred from the dates if 'auto' (default). "
+                               "Durations are windows of that many hours in time, which handles sub-hourly, daily and "
+                               "gappy records. 'records' takes durations as numbers of consecutive records instead")
+    parser.add_argument("--min_completeness", default = None, type = float,
+                        help = "Leave out of the fit the years with a lower fraction of time steps holding a record, e.g. 0.8")
     parser.add_argument("--ci", default = False, type = bool,
                         help = "Should CI be computed?")
+    parser.add_argument("--ci_method", default = "bootstrap", type = str, choices = ["bootstrap", "delta"],
+                        help = "Confidence intervals from 'bootstrap' fits, or by the 'delta' method from a single "
+                               "maximum likelihood fit per duration, much faster but approximate. Default bootstrap")
     parser.add_argument("--number_bootstrap", default = 100, type = int,
                         help = "Number of bootstrap samples to generate, default 100")
     parser.add_argument("--alpha", default = 0.9, type = float,
                         help = "confidence level, e.g. 0.9 or 0.99, default 0.9")
+    parser.add_argument("--n_jobs", default = 1, type = int,
+                        help = "Number of processes used to fit the bootstrap samples, default 1")
+    parser.add_argument("--seed", default = None, type = int,
+                        help = "Seed of the bootstrap random number generator, for reproducible confidence intervals")
+    parser.add_argument("--method", default = "mle", type = str,
+                        help = "GEV estimator, 'mle', 'lmoments' or 'pwm', default 'mle'")
+    parser.add_argument("--cache_dir", default = None, type = str,
+                        help = "Directory where parsed time series are cached, so each csv file is only parsed once")
+    parser.add_argument("--fit_cache", default = None, type = str,
+                        help = "Directory where the GEV fits of each AMS are cached, so rerunning with another alpha does not fit again")
+    parser.add_argument("--fit_cache_size", default = 256, type = float,
+                        help = "Maximum size of the fit cache in MB, least recently used fits are removed beyond it, default 256")
+    parser.add_argument("--chunksize", default = None, type = int,
+                        help = "Read the time series this many records at a time instead of loading it whole, for very long records")
+    parser.add_argument("--incremental", action = "store_true",
+                        help = "Reuse the results saved in savepath by the last run, only processing the years "
+                               "and fitting the durations that changed since then")
+    parser.add_argument("--profile", default = None, type = str,
+                        help = "Save the wall time, CPU time and memory of each stage to this JSON file")
+    parser.add_argument("--profile_dir", default = None, type = str,
+                        help = "With --profile, also dump the cProfile statistics of each stage to this directory")
+    parser.add_argument("--store", default = None, type = str,
+                        help = "Also append the AMS and IDF of each station to the consolidated binary store in this directory")
     parser.add_argument("--savepath", required = True, type = str,
                         help = "Full path where to save all outputs")
     parser.add_argument("--figformat", required = True, type = str,
                         help = "figure file format, either png or pdf")
+    parser.add_argument("--plot", default = "inline", type = str, choices = ["inline", "defer", "none"],
+                        help = "When to draw the IDF figures: 'inline' as each station is done, 'defer' after all "
+                               "stations of a batch, or 'none' to skip them. Default inline")
 
     args=parser.parse_args()
 
@@ -0,0 +1,257 @@
+"""
+File name: store
+
+##############################
+
+Purpose:
+
+Keep the AMS and IDF of many stations in one binary store, so that
+network-wide results are read without parsing one csv file per station.
+
+The IDF of each station is a (return period, bound) block per duration,
+bounds being the lower bound, the estimate and the upper bound (NaN when
+there are no confidence intervals). The blocks of each duration are
+appended to their own raw float64 file, so reading one duration across all
+stations reads a single file, memory-mapped, and only the rows of the
+requested stations. The AMS tables are appended to another file, one row
+per year holding the year and the maxima of each duration. An index file
+lists the rows of each station; writing a station again appends new rows
+and the index points to the latest ones.
+
+The durations and return periods are fixed by the first station appended.
+Only one process should append to a store at a time, readers may run while
+it does.
+
+"""
+
+from constructIDF import AMS
+import pandas as pd
+import numpy as np
+import json
+import os
+
+BOUNDS = ('lower', 'estimate', 'upper')
+PREFIXES = ('L', '', 'U')
+INDEX_COLUMNS = ['station', 'row', 'ams_start', 'ams_years']
+
+
+def return_period_label(return_period):
+    """
+    Row label of a return period in the IDF table, e.g. 2 -> "2-yr".
+    """
+    if isinstance(return_period, str):
+        return return_period
+    return "{:g}-yr".format(return_period)
+
+
+class ResultStore:
+
+    """
+    Consolidated store of the AMS and IDF tables of many stations.
+
+    Parameters
+    ----------
+    Input:
+        path: str, directory of the store, created if it does not exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.meta = None
+        if os.path.exists(self._file('meta.json')):
+            with open(self._file('meta.json')) as f:
+                self.meta = json.load(f)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @property
+    def durations(self):
+        return [] if self.meta is None else self.meta['durations']
+
+    @property
+    def return_periods(self):
+        return [] if self.meta is None else self.meta['return_periods']
+
+    def append(self, station, idf, ams=None):
+        """
+        Add the results of one station, replacing those written before under the same name.
+
+        Parameters
+        ----------
+        Input:
+            station: str, station identifier.
+            idf: DataFrame, IDF table, with or without confidence bounds, see IDF.construct_IDF.
+            ams: DataFrame, AMS table with a year column and one column per duration,
+                 see AMS.calculate_AMS. Not stored if None.
+        """
+        return_periods = [x for x in idf.index if x[:1] not in ('L', 'U')]
+        durations = list(idf.columns)
+        if self.meta is None:
+            self.meta = {'durations': durations, 'return_periods': return_periods,
+                         'bounds': list(BOUNDS)}
+            with open(self._file('meta.json'), 'w') as f:
+                json.dump(self.meta, f)
+        elif durations != self.durations or return_periods != self.return_periods:
+            raise ValueError("Station {} has durations {} and return periods {}, the store has {} and {}".format(
+                station, durations, return_periods, self.durations, self.return_periods))
+
+        # (duration, return period, bound) block, bounds missing from idf are NaN.
+        block = np.full((len(durations), len(return_periods), len(BOUNDS)), np.nan)
+        for b, prefix in enumerate(PREFIXES):
+            labels = [prefix + x for x in return_periods]
+            if all(label in idf.index for label in labels):
+                block[:, :, b] = idf.loc[labels, durations].values.astype(float).T
+
+        row = self._rows(0)
+        for j in range(len(durations)):
+            with open(self._file('idf_{}.f8'.format(j)), 'ab') as f:
+                f.write(block[j].tobytes())
+
+        ams_start, ams_years = self._ams_rows(), 0
+        if ams is not None:
+            table = np.column_stack([ams['year'].values.astype(float),
+                                     ams[durations].values.astype(float)])
+            with open(self._file('ams.f8'), 'ab') as f:
+                f.write(np.ascontiguousarray(table).tobytes())
+            ams_years = len(table)
+
+        # The index is written last so readers never see rows that are not complete.
+        index = self._file('index.csv')
+        new = not os.path.exists(index)
+        with open(index, 'a') as f:
+            if new:
+                f.write(','.join(INDEX_COLUMNS) + '\n')
+            f.write('{},{},{},{}\n'.format(station, row, ams_start, ams_years))
+
+    def _rows(self, j):
+        path = self._file('idf_{}.f8'.format(j))
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (8 * len(self.return_periods) * len(BOUNDS))
+
+    def _ams_rows(self):
+        path = self._file('ams.f8')
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (8 * (len(self.durations) + 1))
+
+    def index(self):
+        """
+        Rows of the latest results of each station.
+
+        Output:
+            DataFrame, indexed by station, with the row of its IDF and the first row and
+            number of years of its AMS.
+        """
+        path = self._file('index.csv')
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=INDEX_COLUMNS[1:], index=pd.Index([], name='station'))
+        index = pd.read_csv(path, dtype={'station': str})
+        return index.drop_duplicates('station', keep='last').set_index('station')
+
+    def stations(self):
+        """
+        Identifiers of the stations in the store.
+        """
+        return list(self.index().index)
+
+    def _idf_cube(self, j, rows):
+        shape = (self._rows(j), len(self.return_periods), len(BOUNDS))
+        if shape[0] == 0:
+            return np.empty((0,) + shape[1:])
+        return np.memmap(self._file('idf_{}.f8'.format(j)), dtype=np.float64, mode='r',
+                         shape=shape)[rows]
+
+    def _selected(self, stations):
+        index = self.index()
+        if stations is not None:
+            index = index.loc[list(stations)]
+        return index
+
+    def duration(self, duration, bound='estimate', stations=None):
+        """
+        Rainfall depth of one duration for every return period across stations.
+
+        Parameters
+        ----------
+        Input:
+            duration: str or int, duration label (e.g. "24H" or "1D") or hours, see AMS.duration_label.
+            bound: str, one of "lower", "estimate" or "upper".
+            stations: list of str, stations to read, all by default.
+        Output:
+            DataFrame, one row per station and one column per return period.
+        """
+        j = self.durations.index(AMS.duration_label(duration))
+        index = self._selected(stations)
+        values = self._idf_cube(j, index['row'].values)[:, :, BOUNDS.index(bound)]
+        return pd.DataFrame(values, index=index.index, columns=self.return_periods)
+
+    def return_period(self, return_period, bound='estimate', stations=None):
+        """
+        Rainfall depth of one return period for every duration across stations.
+
+        Parameters
+        ----------
+        Input:
+            return_period: str or float, return period label (e.g. "100-yr") or years.
+            bound: str, one of "lower", "estimate" or "upper".
+            stations: list of str, stations to read, all by default.
+        Output:
+            DataFrame, one row per station and one column per duration.
+        """
+        r = self.return_periods.index(return_period_label(return_period))
+        b = BOUNDS.index(bound)
+        index = self._selected(stations)
+        rows = index['row'].values
+        return pd.DataFrame({label: self._idf_cube(j, rows)[:, r, b]
+                             for j, label in enumerate(self.durations)}, index=index.index)
+
+    def idf(self, station):
+        """
+        IDF table of one station, laid out as IDF.csv.
+        """
+        row = self.index().loc[station, 'row']
+        block = np.stack([self._idf_cube(j, [row])[0] for j in range(len(self.durations))])
+        prefixes = PREFIXES if not np.isnan(block[:, :, 0]).all() else ('',)
+        tables = []
+        for prefix in prefixes:
+            values = block[:, :, PREFIXES.index(prefix)].T
+            tables.append(pd.DataFrame(values, columns=self.durations,
+                                       index=[prefix + x for x in self.return_periods]))
+        return pd.concat(tables)
+
+    def ams(self, station):
+        """
+        AMS table of one station, with a year column and one column per duration.
+        """
+        entry = self.index().loc[station]
+        start, years = int(entry['ams_start']), int(entry['ams_years'])
+        table = self._ams_table()[start:start + years]
+        ams = pd.DataFrame(np.array(table[:, 1:]), columns=self.durations)
+        ams.insert(0, 'year', table[:, 0].astype(int))
+        return ams
+
+    def ams_duration(self, duration, stations=None):
+        """
+        AMS of one duration across stations.
+
+        Output:
+            DataFrame, with station, year and AMS value columns.
+        """
+        j = self.durations.index(AMS.duration_label(duration)) + 1
+        index = self._selected(stations)
+        table = self._ams_table()
+        rows = [np.arange(start, start + years) for start, years in
+                zip(index['ams_start'].values, index['ams_years'].values)]
+        rows = np.concatenate(rows) if rows else np.empty(0, dtype=int)
+        return pd.DataFrame({'station': np.repeat(index.index.values, index['ams_years'].values),
+                             'year': table[rows, 0].astype(int),
+                             AMS.duration_label(duration): table[rows, j]})
+
+    def _ams_table(self):
+        shape = (self._ams_rows(), len(self.durations) + 1)
+        if shape[0] == 0:
+            return np.empty(shape)
+        return np.memmap(self._file('ams.f8'), dtype=np.float64, mode='r', shape=shape)
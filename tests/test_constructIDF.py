@@ -0,0 +1,185 @@
+from constructIDF import AMS, IDF, fit_gev_rows
+import pandas as pd
+import numpy as np
+import pytest
+
+
+@pytest.mark.parametrize("method", ["lmoments", "pwm"])
+def test_closed_form_fit_of_tied_sample_is_nan(method):
+    samples = np.array([[2.0, 2.0, 2.0, 2.0, 2.0, 2.0],
+                        [2.0, 2.0, 2.0, 2.0, 2.0, 3.0]])
+    fits = fit_gev_rows(samples, method)
+    assert np.isnan(fits[0]).all()
+    assert np.isfinite(fits[1]).all() and fits[1, 2] > 0
+
+
+@pytest.mark.parametrize("method", ["lmoments", "pwm"])
+def test_bootstrap_bounds_of_short_tied_ams_are_finite(method):
+    # 6 years with 5 tied values: about 1 in 300 resamples holds only the tied value.
+    ams = pd.DataFrame({'year': range(2000, 2006),
+                        '1H': [1.0, 1.2, 0.9, 1.5, 1.1, 1.3],
+                        '72H': [2.0, 2.0, 2.0, 2.0, 2.0, 3.0]})
+    data = IDF(ams, True, 1000, 0.9, seed=3, method=method)
+    data.construct_IDF()
+
+    assert np.isfinite(data.idf.values).all()
+    lower, upper = data.idf.loc['L10-yr'], data.idf.loc['U10-yr']
+    assert (lower <= data.idf.loc['10-yr']).all() and (data.idf.loc['10-yr'] <= upper).all()
+
+
+def test_added_durations_and_return_periods_are_sorted():
+    dates = pd.date_range('2000-01-01', '2003-12-31 23:00', freq='h')
+    rainfall = np.random.default_rng(0).gamma(0.1, 1, len(dates))
+    series = AMS(pd.DataFrame({'date': dates, 'val': rainfall}), [2, 24])
+    series.calculate_AMS('sliding')
+    ams = series.add_durations([48, 1, 6])
+    assert list(ams.columns) == ['year', '1H', '2H', '6H', '24H', '48H']
+    assert list(series.completeness.columns) == list(ams.columns)
+
+    data = IDF(ams, False, 100, 0.9, method='lmoments')
+    data.construct_IDF()
+    data.set_return_periods([100, 2, 10])
+    assert list(data.idf.index) == ['2-yr', '10-yr', '100-yr']
+    assert (data.idf.diff().iloc[1:] > 0).all().all()
+
+
+@pytest.mark.parametrize("method, ci, ci_method", [
+    ("mle", False, "bootstrap"), ("mle", True, "bootstrap"), ("mle", True, "delta"),
+    ("lmoments", True, "bootstrap"), ("pwm", False, "bootstrap")])
+def test_duration_without_enough_years_is_not_fitted(method, ci, ci_method):
+    rng = np.random.default_rng(1)
+    years = np.arange(1980, 2000)
+    ams = pd.DataFrame({'year': years, '1H': rng.gumbel(1, 0.3, 20), '24H': rng.gumbel(3, 0.8, 20)})
+    completeness = pd.DataFrame({'year': years, '1H': 1.0, '24H': 0.5})
+    completeness.loc[:1, '24H'] = 1.0
+
+    data = IDF(ams, ci, 50, 0.9, seed=0, method=method, completeness=completeness,
+               min_completeness=0.8, ci_method=ci_method)
+    with pytest.warns(UserWarning, match='24H'):
+        data.construct_IDF()
+
+    assert data.unfitted == ['24H']
+    assert data.idf['24H'].isna().all()
+    assert np.isfinite(data.idf['1H'].values).all()
+
+
+def test_completeness_is_the_share_of_the_year_with_records():
+    dates = pd.date_range('1970-01-01', '1971-12-31 23:00', freq='h')
+    rainfall = np.random.default_rng(2).gamma(0.1, 1, len(dates))
+    # 2% of random hours missing in 1970, everything after January missing in 1971.
+    rainfall[np.random.default_rng(3).random(len(dates)) < 0.02] = np.nan
+    rainfall[(dates.year == 1971) & (dates.month > 1)] = np.nan
+    frame = pd.DataFrame({'date': dates, 'val': rainfall})
+
+    for timestep in (None, 'auto'):
+        series = AMS(frame, [1, 24, 72], timestep=timestep)
+        _, completeness = series.calculate_AMS('sliding', return_completeness=True)
+        values = completeness.set_index('year')
+        assert np.allclose(values.loc[1970], 0.98, atol=0.005)
+        assert np.allclose(values.loc[1971], 31 / 365, atol=0.005)
+
+
+@pytest.mark.parametrize("ams_type", ["sliding", "fixed"])
+def test_vectorized_engine_matches_reference(ams_type):
+    rng = np.random.default_rng(4)
+    dates = pd.date_range('1990-03-05 07:00', '1994-11-20 16:00', freq='h')
+    rainfall = np.round(rng.gamma(0.2, 1, len(dates)), 2)
+    rainfall[rng.random(len(dates)) < 0.05] = np.nan
+    # Missing rows, including a whole month, shift the record-count windows.
+    kept = (rng.random(len(dates)) > 0.03) & ~((dates.year == 1992) & (dates.month == 7))
+    frame = pd.DataFrame({'date': dates[kept], 'val': rainfall[kept]})
+    durations = [1, 2, 3, 6, 24, 72]
+
+    vectorized, completeness = AMS(frame, durations, timestep=None).calculate_AMS(
+        ams_type, return_completeness=True)
+    reference, reference_completeness = AMS(frame, durations, timestep=None).calculate_AMS(
+        ams_type, engine='reference', return_completeness=True)
+    pd.testing.assert_frame_equal(vectorized, reference, check_dtype=False)
+    pd.testing.assert_frame_equal(completeness, reference_completeness)
+
+
+@pytest.mark.parametrize("timestep, durations", [(None, [1, 5, 24, 72]), ('auto', ['30min', 1, 5, 24, 72])])
+@pytest.mark.parametrize("ams_type", ["sliding", "fixed"])
+def test_chunked_extraction_matches_in_memory(tmp_path, ams_type, timestep, durations):
+    rng = np.random.default_rng(5)
+    dates = pd.date_range('1995-10-01', '1998-02-15', freq='30min')
+    rainfall = np.round(rng.gamma(0.1, 1, len(dates)), 2)
+    rainfall[rng.random(len(dates)) < 0.05] = np.nan
+    # Heavy rain across the new year, so the largest windows span chunk and year boundaries.
+    storm = (dates >= '1996-12-31 20:00') & (dates < '1997-01-01 04:00')
+    rainfall[storm] = 5.0
+    kept = rng.random(len(dates)) > 0.02
+    path = str(tmp_path / 'station.csv')
+    pd.DataFrame({'date': dates[kept], 'val': rainfall[kept], 'qflags': np.nan,
+                  'mflags': np.nan}).to_csv(path)
+
+    expected = AMS(path, durations, timestep=timestep).calculate_AMS(ams_type, return_completeness=True)
+    # 1001 records is not a divisor of a year, and a chunk ends within the storm.
+    for chunksize in (1001, int(np.flatnonzero(storm[kept])[3])):
+        chunked = AMS(path, durations, chunksize=chunksize, timestep=timestep).calculate_AMS(
+            ams_type, return_completeness=True)
+        pd.testing.assert_frame_equal(chunked[0], expected[0], check_dtype=False)
+        pd.testing.assert_frame_equal(chunked[1], expected[1], check_dtype=False)
+
+
+def gappy_quarter_hours(seed):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2003-01-01', '2005-12-31 23:45', freq='15min')
+    rainfall = np.round(rng.gamma(0.05, 2, len(dates)), 2)
+    rainfall[rng.random(len(dates)) < 0.03] = np.nan
+    kept = (rng.random(len(dates)) > 0.1) & ~((dates >= '2004-05-10') & (dates < '2004-06-02'))
+    return pd.DataFrame({'date': dates[kept], 'val': rainfall[kept]})
+
+
+@pytest.mark.parametrize("ams_type", ["sliding", "fixed"])
+def test_time_durations_match_pandas_windows(ams_type):
+    frame = gappy_quarter_hours(6)
+    durations = ['15min', '45min', 1, '6H', '24H']
+
+    ams = AMS(frame, durations).calculate_AMS(ams_type).set_index('year')
+
+    for year, records in frame.groupby(frame.date.dt.year):
+        series = records.set_index('date').val
+        for d in durations:
+            window = AMS.as_timedelta(d)
+            if ams_type == 'sliding':
+                expected = series.rolling(window).sum().max()
+            else:
+                expected = series.resample(window, origin=pd.Timestamp(year, 1, 1)).sum().max()
+            assert np.isclose(ams.loc[year, AMS.duration_label(d)], expected), (year, d)
+
+
+def test_time_step_is_inferred_from_gappy_records():
+    frame = gappy_quarter_hours(7)
+    assert AMS.time_step(frame.date.values) == pd.Timedelta('15min')
+    daily = frame[frame.date.dt.hour.eq(0) & frame.date.dt.minute.eq(0)]
+    assert AMS.time_step(daily.date.values[::-1]) == pd.Timedelta('1D')
+
+    series = AMS(frame, [1, 24])
+    series.calculate_AMS('sliding')
+    assert series.window_sums.timestep == pd.Timedelta('15min')
+    with pytest.raises(ValueError, match='multiple of the time step'):
+        AMS(daily, ['6H']).calculate_AMS('sliding')
+
+
+def delta_idf(years, seed=8, n_jobs=1):
+    rng = np.random.default_rng(seed)
+    ams = pd.DataFrame({'year': np.arange(years), '1H': rng.gumbel(1, 0.3, years),
+                        '24H': rng.gumbel(3, 0.8, years)})
+    data = IDF(ams, True, 100, 0.9, n_jobs=n_jobs, method='mle', ci_method='delta')
+    data.construct_IDF()
+    return data.idf
+
+
+def test_delta_method_bounds():
+    short, long = delta_idf(25), delta_idf(400)
+    for idf in (short, long):
+        estimate = idf.loc[['2-yr', '10-yr', '100-yr']].values
+        assert (idf.loc[['L2-yr', 'L10-yr', 'L100-yr']].values < estimate).all()
+        assert (estimate < idf.loc[['U2-yr', 'U10-yr', 'U100-yr']].values).all()
+
+    def width(idf):
+        return idf.loc[['U2-yr', 'U100-yr']].values - idf.loc[['L2-yr', 'L100-yr']].values
+    assert (width(long) < width(short)).all()
+
+    pd.testing.assert_frame_equal(delta_idf(25, n_jobs=2), short)
@@ -0,0 +1,42 @@
+from incremental import update_station
+import pandas as pd
+import numpy as np
+
+
+def write_station(path, frame):
+    frame.assign(qflags=np.nan, mflags=np.nan).to_csv(path)
+
+
+def test_appended_records_refit_only_changed_durations(tmp_path):
+    rng = np.random.default_rng(9)
+    dates = pd.date_range('2001-01-01', '2010-12-30 23:00', freq='h')
+    rainfall = np.round(rng.gamma(0.1, 0.5, len(dates)), 2)
+    # A three-day storm every year, the longest windows of the last year stay on it.
+    for year in range(2001, 2011):
+        storm = (dates >= '{}-06-01'.format(year)) & (dates < '{}-06-04'.format(year))
+        rainfall[storm] = 2.0 + rng.random(storm.sum())
+    frame = pd.DataFrame({'date': dates, 'val': rainfall})
+    path = str(tmp_path / 'station.csv')
+    write_station(path, frame)
+    durations = [1, 24, 72]
+    options = dict(method='lmoments', return_periods=[2, 10, 100])
+
+    savepath = tmp_path / 'run'
+    savepath.mkdir()
+    update_station(path, str(savepath), durations, 'sliding', **options)
+
+    # One heavy hour on the last day of 2010 raises the 1H maximum only.
+    appended = pd.DataFrame({'date': pd.date_range('2010-12-31', periods=24, freq='h'), 'val': 0.0})
+    appended.loc[5, 'val'] = 12.0
+    write_station(path, pd.concat([frame, appended], ignore_index=True))
+    out, data, updated = update_station(path, str(savepath), durations, 'sliding', **options)
+
+    assert updated == {'years': [2010], 'durations': ['1H']}
+    assert out.set_index('year').loc[2010, '1H'] == 12.0
+
+    fresh = tmp_path / 'fresh'
+    fresh.mkdir()
+    full_out, full_data, full_updated = update_station(path, str(fresh), durations, 'sliding', **options)
+    assert full_updated['durations'] == ['1H', '24H', '72H']
+    pd.testing.assert_frame_equal(out, full_out)
+    pd.testing.assert_frame_equal(data.idf, full_data.idf)
@@ -0,0 +1,58 @@
+from batch import find_stations
+from constructIDF import AMS
+import cache
+import ingest
+import pandas as pd
+import numpy as np
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'ncei')
+
+
+def read_converted(path):
+    return pd.read_csv(path, index_col=0, parse_dates=['date'])
+
+
+def test_wide_layout_round_trip(tmp_path):
+    savepath = str(tmp_path / 'stations')
+    summary = ingest.convert_file(os.path.join(FIXTURES, 'USC00000001.csv'), savepath,
+                                  cache_dir=str(tmp_path / 'cache'))
+    assert summary['station'] == 'USC00000001' and summary['records'] == 48
+    assert summary['latitude'] == 40.5 and summary['longitude'] == -80.2
+
+    series = read_converted(summary['path']).set_index('date')
+    assert len(series) == 48 and series.index.is_monotonic_increasing
+    assert series.loc['1950-01-01 03:00', 'val'] == 0.22
+    assert series.loc['1950-01-01 04:00', 'qflags'] == 'Q'
+    assert np.isnan(series.loc['1950-01-01 17:00', 'val'])
+    assert series.loc['1950-01-01 17:00', 'mflags'] == 'M'
+    assert series.loc['1950-01-02 23:00', 'val'] == 0.07
+    assert np.isclose(series['val'].sum(), 0.44)
+
+    minutes, values, column = cache.load_series(summary['path'], str(tmp_path / 'cache'))
+    np.testing.assert_array_equal(values, series['val'].values)
+    np.testing.assert_array_equal(
+        np.asarray(minutes, dtype=np.int64), series.index.values.astype('datetime64[m]').astype(np.int64))
+
+    ams = AMS(summary['path'], [1, 2]).calculate_AMS('fixed')
+    assert np.allclose(ams[['1H', '2H']].values, [[0.22, 0.22]])
+
+
+def test_long_layout_round_trip(tmp_path):
+    summary = ingest.convert_file(os.path.join(FIXTURES, 'CDO000001.csv'), str(tmp_path))
+    assert summary['id'] == 'COOP:000001' and summary['records'] == 4
+
+    series = read_converted(summary['path'])
+    assert list(series['date']) == list(pd.to_datetime(
+        ['1950-01-01 03:00', '1950-01-01 04:00', '1950-01-01 17:00', '1950-01-02 00:00']))
+    assert series['val'].isna().tolist() == [False, False, True, False]
+    assert np.allclose(series['val'].dropna(), [0.22, 0.05, 0.10])
+    assert series['qflags'].tolist()[1] == 'Q' and series['mflags'].tolist()[2] == 'M'
+
+
+def test_single_raw_file_is_one_station(tmp_path):
+    path = os.path.join(FIXTURES, 'USC00000001.csv')
+    assert find_stations(path) == [path]
+
+    stations, failures = ingest.convert_many(find_stations(path), str(tmp_path))
+    assert failures.empty and list(stations['station']) == ['USC00000001']
@@ -0,0 +1,57 @@
+from constructIDF import IDF
+from store import ResultStore
+import pandas as pd
+import numpy as np
+import pytest
+
+
+def fitted(seed, ci, years=15):
+    rng = np.random.default_rng(seed)
+    ams = pd.DataFrame({'year': np.arange(1990, 1990 + years),
+                        '1H': rng.gumbel(1, 0.3, years), '24H': rng.gumbel(3, 0.8, years)})
+    data = IDF(ams, ci, 50, 0.9, seed=seed, method='lmoments', return_periods=[2, 10, 100])
+    data.construct_IDF()
+    return data.idf, ams
+
+
+@pytest.mark.parametrize("ci", [False, True])
+def test_idf_and_ams_round_trip(tmp_path, ci):
+    idf, ams = fitted(0, ci)
+    store = ResultStore(str(tmp_path))
+    store.append('A', idf, ams)
+
+    stored = ResultStore(str(tmp_path)).idf('A')
+    assert sorted(stored.index) == sorted(idf.index)
+    pd.testing.assert_frame_equal(stored, idf.loc[stored.index], check_names=False)
+    pd.testing.assert_frame_equal(store.ams('A'), ams, check_dtype=False)
+    assert list(store.duration('24H').columns) == ['2-yr', '10-yr', '100-yr']
+    if ci:
+        assert np.allclose(store.return_period(100, 'upper').values, idf.loc[['U100-yr']].values)
+    else:
+        assert store.return_period(100, 'upper').isna().all().all()
+
+
+def test_appending_a_station_again_replaces_it(tmp_path):
+    store = ResultStore(str(tmp_path))
+    first, first_ams = fitted(1, False)
+    other, other_ams = fitted(2, False)
+    latest, latest_ams = fitted(3, False, years=12)
+    store.append('A', first, first_ams)
+    store.append('B', other, other_ams)
+    store.append('A', latest, latest_ams)
+
+    assert store.stations() == ['B', 'A']
+    pd.testing.assert_frame_equal(store.idf('A'), latest, check_names=False)
+    pd.testing.assert_frame_equal(store.ams('A'), latest_ams, check_dtype=False)
+    pd.testing.assert_frame_equal(store.idf('B'), other, check_names=False)
+    assert np.allclose(store.duration('1H').loc['A'].values, latest['1H'].values)
+    assert len(store.ams_duration('24H', stations=['A'])) == 12
+
+
+def test_station_with_other_durations_is_rejected(tmp_path):
+    store = ResultStore(str(tmp_path))
+    idf, ams = fitted(4, False)
+    store.append('A', idf, ams)
+    with pytest.raises(ValueError, match='durations'):
+        store.append('B', idf[['1H']], ams[['year', '1H']])
+    assert store.stations() == ['A']